@@ -1,7 +1,12 @@
-from lib.addon import Addon
-from lib.deezerbackend import DeezerBackend
+import sys
 from lib.kodi_frontend import KodiFrontend
+from lib.resident import DEFAULT_PORT, forward
 
 kodi = KodiFrontend()
-deezer = DeezerBackend(kodi)
-Addon(deezer, kodi, debug=True).main()
\ No newline at end of file
+kodi.debug(True)
+if kodi.get_setting('resident_service') != 'true' or \
+        not forward(kodi, sys.argv[2], int(kodi.get_setting('resident_service_port') or DEFAULT_PORT)):
+    from lib.addon import Addon
+    from lib.deezerbackend import DeezerBackend
+    deezer = DeezerBackend(kodi)
+    Addon(deezer, kodi, debug=True).main()
\ No newline at end of file
@@ -1,6 +1,9 @@
 # https://docs.python.org/2.7/
 import sys
+import time
 import urlparse
+from lib.routes import Routes, query
+from lib.tracing import Tracer
 
 class Addon:
 
@@ -15,51 +18,158 @@ class Addon:
 
     def render(self, url):
         """Render the menu for the specified url"""
+        tracer = self._frontend.tracer
         mode = None
+        error = None
+        shown = None
         try:
-            args =  urlparse.parse_qs(url[1:])
-            for key in args:
-                args[key] = args[key][0]
-
-            mode = args.get(Backend.MODE, None)
-            if mode is None:
-                self.log('no arguments -> render root dir')
-                items = self._backend.root()
-            else:
-                self.log('arguments: ' + str(args))
-                args.pop(Backend.MODE)
-                items = getattr(self._backend, mode)(**args)
+            with tracer.span('route') as span:
+                args =  urlparse.parse_qs(url[1:])
+                for key in args:
+                    args[key] = args[key][0]
+
+                mode = args.pop(Backend.MODE, None)
+                if mode is None:
+                    self._backend.navigate(mode)
+                    self.log('no arguments -> render root dir')
+                    items = self._backend.root()
+                else:
+                    self.log('arguments: ' + str(args))
+                    route = self._backend.routes().get(mode)
+                    args, ignored = route.convert(args)
+                    if ignored:
+                        self.log('ignored arguments of %s: %s' % (mode, ', '.join(ignored)))
+                    span['args'] = args
+                    self._backend.navigate(mode)
+                    items = getattr(self._backend, route.mode)(**args)
+                span['mode'] = mode or 'root'
             if items:
-                self._frontend.render(list(items))
+                items = ObservedItems(items)
+                with tracer.span('render') as span:
+                    self._frontend.render(items, self._backend.directory_hints(mode, args))
+                    span['items'] = items.count
+                    span['extract_ms'] = round(items.seconds * 1000, 2)
+                shown = items.head + items.tail
+        except Exception as exception:
+            error = repr(exception)
+            raise
         finally:
-            pass
+            self._backend.finish()
+            self._write_trace(mode, error)
+        # prefetching outlives the invocation, it finishes on its own
+        if shown:
+            self._backend.prefetch(shown)
+
+    def _write_trace(self, mode, error):
+        if self._frontend.get_setting('tracing') != 'true':
+            return
+        directory = self._frontend.get_profile_dir()
+        if directory:
+            try:
+                self._frontend.tracer.write(directory, mode=mode or 'root', error=error)
+            except (IOError, OSError) as exception:
+                self.log('writing trace failed: %s' % exception)
 
     def main(self):
         self.log(sys.argv)
         self.render(sys.argv[2])
 
 
+class ObservedItems(object):
+    """Passes the items of a backend generator on as they are extracted.
+
+    Counts them, times the extraction and keeps the first and the last items
+    (where the next page entry is) for prefetching."""
+
+    HEAD = 20
+
+    def __init__(self, items):
+        self._items = items
+        self.count = 0
+        self.seconds = 0.0
+        self.head = []
+        self.tail = []
+
+    def __iter__(self):
+        iterator = iter(self._items)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.seconds += time.time() - start
+            self.count += 1
+            if len(self.head) < self.HEAD:
+                self.head.append(item)
+            else:
+                self.tail = [item]
+            yield item
+
+
 class Backend:
     """Empty audio backend"""
 
     LABEL = 'label'
     MODE = 'mode'
     THUMB = 'thumb'
+    FANART = 'fanart'
     URL = 'url'
     TARGET = 'target'
     TRACK_TITLE = 'title'
     TRACK_NUM = 'tracknumber'
     DURATION = 'duration'
     ALBUM_NAME = 'album'
+    ALBUM_TRACK_COUNT = 'track_count'
     YEAR = 'year'
     ARTIST = 'artist'
+    # modes reachable through urls with the types of their arguments, {mode: {argument: type}}
+    ROUTES = {}
 
     def __init__(self, frontend):
         self._frontend = frontend
 
+    @classmethod
+    def routes(cls):
+        """the route table compiled from ROUTES, once per class"""
+        if '_routes' not in cls.__dict__:
+            cls._routes = Routes(cls.ROUTES)
+        return cls._routes
+
+    def target(self, mode, **args):
+        """target of an entry leading to mode, raises for modes and arguments missing in ROUTES"""
+        return self.routes().get(mode).target(self.MODE, **args)
+
     def log(self, message):
         self._frontend.log(message)
 
+    def _int_setting(self, name, default):
+        try:
+            return int(self._frontend.get_setting(name))
+        except (TypeError, ValueError):
+            return default
+
+    def navigate(self, mode):
+        """called before the menu of mode is rendered"""
+        pass
+
+    def directory_hints(self, mode, args):
+        """hints for the frontend how to present and cache the listing of mode"""
+        return {}
+
+    def prefetch(self, items):
+        """called after items were rendered and finish(), may load what is likely requested next"""
+        pass
+
+    def finish(self):
+        """called once the invocation is done, even if it failed"""
+        pass
+
+    def stop_prefetch(self):
+        """called before a long-lived backend serves the next invocation"""
+        pass
+
     def root(self):
         """list of root menu entries"""
         return []
@@ -69,6 +179,8 @@ class Frontend:
 
     def __init__(self, debug=False):
         self._debug = debug
+        self._total_items = 0
+        self.tracer = Tracer()
 
     def get_setting(self, name):
         """request setting value"""
@@ -78,6 +190,10 @@ class Frontend:
         """set setting value"""
         raise NotImplementedError
 
+    def get_profile_dir(self):
+        """directory for persistent data, None if there is none"""
+        return None
+
     def debug(self, value):
         self._debug = value
 
@@ -90,9 +206,26 @@ class Frontend:
         """request user input"""
         raise NotImplementedError
 
-    def render(self, items):
-        """render a list of items"""
+    def set_total_items(self, count):
+        """hint how many items the listing being rendered will have"""
+        self._total_items = count
+
+    def render(self, items, hints=None):
+        """render the items as they are produced, hints come from Backend.directory_hints"""
+        raise NotImplementedError
+
+    def notify(self, message):
+        """show a short message that disappears by itself"""
+        raise NotImplementedError
+
+    def resolve(self, url):
+        """hand the stream url of the playable item to the player"""
+        raise NotImplementedError
+
+    def run_background(self, params):
+        """run the callback for the provided params detached from this invocation"""
         raise NotImplementedError
 
     def build_url(self, params):
         """"build a callback url for the provided params"""
+        return '?' + query(params)
@@ -0,0 +1,85 @@
+"""Local copies of the artwork shown in listings"""
+
+import hashlib
+import os
+import threading
+from urlparse import urlparse
+from lib.files import atomic_write, makedirs, remove
+from lib.transport import Transport
+
+class ArtworkCache(object):
+    """Image files in a directory of the profile named after the hash of their url.
+
+    path() returns the local file of an image downloaded before and queues
+    the download of any other. Queued images are downloaded by at most
+    workers threads while the listing is rendered, finish() waits for them
+    and deletes the least recently used files beyond max_entries."""
+
+    def __init__(self, directory, max_entries=2000, workers=4, transport=None, log=None):
+        self._directory = directory
+        self._max_entries = max_entries
+        self._workers = workers
+        self._transport = transport or Transport(retries=0, pool_size=workers)
+        self._log = log or (lambda message: None)
+        self._pending = []
+        self._queued = set()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.downloaded = 0
+        makedirs(directory)
+
+    def _file(self, url):
+        extension = os.path.splitext(urlparse(url).path)[1] or '.jpg'
+        return os.path.join(self._directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + extension)
+
+    def path(self, url):
+        """the local file of the image if it is cached, else the url while it is downloaded"""
+        local = self._file(url)
+        try:
+            os.utime(local, None)
+            return local
+        except OSError:
+            pass
+        with self._lock:
+            if url not in self._queued:
+                self._queued.add(url)
+                self._pending.append(url)
+                if len(self._threads) < self._workers:
+                    thread = threading.Thread(target=self._work)
+                    thread.start()
+                    self._threads.append(thread)
+        return url
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    # leaving under the lock, path() starts a new thread for later urls
+                    self._threads.remove(threading.current_thread())
+                    return
+                url = self._pending.pop(0)
+            try:
+                response = self._transport.get(url, timeout=10)
+                if response.status_code == 200 and response.content:
+                    atomic_write(self._file(url), response.content)
+                    with self._lock:
+                        self.downloaded += 1
+            except Exception as error:
+                self._log('artwork %s not cached: %s' % (url, error))
+
+    def finish(self, timeout=30):
+        """wait for the queued downloads and evict the least recently used files"""
+        for thread in list(self._threads):
+            thread.join(timeout)
+        names = os.listdir(self._directory)
+        if len(names) <= self._max_entries:
+            return
+        entries = []
+        for name in names:
+            try:
+                entries.append((os.stat(os.path.join(self._directory, name)).st_mtime, name))
+            except OSError:
+                continue
+        entries.sort()
+        for _, name in entries[:len(entries) - self._max_entries]:
+            remove(os.path.join(self._directory, name))
@@ -0,0 +1,446 @@
+"""Benchmark of Addon.render against a local stand-in of the Deezer API
+
+Starts a stub server generating synthetic catalogues of configurable size
+with injected latency and renders every mode in a fresh interpreter, so
+wall time and peak memory are measured per mode:
+
+    python -m lib.benchmark --album-size 30 --playlist-length 2000 --latency 50
+    python -m lib.benchmark --save bench.json
+    python -m lib.benchmark --baseline bench.json
+    python -m lib.benchmark --memory 5000
+    python -m lib.benchmark --routing 20000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+from lib.addon import Addon, Frontend
+from lib.deezerbackend import DeezerBackend
+from lib.transport import Transport
+
+MODES = (
+    ('root', ''),
+    ('albums', '?mode=albums'),
+    ('album', '?mode=album&album_id=1'),
+    ('playlist', '?mode=playlist&playlist_id=1'),
+    ('artist_albums', '?mode=artist_albums&artist_id=1'),
+    ('search', '?mode=search&query=artist'),
+    ('my_artists', '?mode=my_artists'),
+    ('my_albums', '?mode=my_albums'),
+    ('my_playlists', '?mode=my_playlists'),
+)
+# metrics compared against a baseline, relative increase reported as regression
+METRICS = ('requests', 'seconds', 'peak_kb')
+API_HOSTS = re.compile(r'^https?://(api|tv)\.deezer\.com')
+
+class Catalogue(object):
+    """Synthetic Deezer catalogue answering the api paths the backend uses"""
+
+    EMBEDDED_TRACKS = 400
+
+    def __init__(self, album_size=15, playlist_length=100, library_size=100, artist_albums=50, search_results=100):
+        self.album_size = album_size
+        self.playlist_length = playlist_length
+        self.library_size = library_size
+        self.artist_albums = artist_albums
+        self.search_results = search_results
+
+    @staticmethod
+    def _pictures(prefix, kind, item_id):
+        return dict(('%s_%s' % (prefix, size), 'http://img/%s/%s/%s.jpg' % (kind, item_id, size))
+                    for size in ('small', 'medium', 'big', 'xl'))
+
+    def artist(self, artist_id):
+        result = {'id': artist_id, 'name': 'Artist %s' % artist_id, 'type': 'artist'}
+        result.update(self._pictures('picture', 'artist', artist_id))
+        return result
+
+    def album(self, album_id):
+        result = {
+            'id': album_id,
+            'title': 'Album %s' % album_id,
+            'release_date': '2001-02-03',
+            'nb_tracks': self.album_size,
+            'artist': self.artist(int(album_id) % 50),
+            'type': 'album'
+        }
+        result.update(self._pictures('cover', 'album', album_id))
+        return result
+
+    def track(self, track_id, position=1):
+        album_id = int(track_id) // 100
+        return {
+            'id': track_id,
+            'title': 'Track %s' % track_id,
+            'duration': 200 + int(track_id) % 100,
+            'track_position': position,
+            'release_date': '2001-02-03',
+            'album': self.album(album_id),
+            'artist': self.artist(album_id % 50),
+            'type': 'track'
+        }
+
+    def playlist(self, playlist_id):
+        result = {
+            'id': playlist_id,
+            'title': 'Playlist %s' % playlist_id,
+            'nb_tracks': self.playlist_length,
+            'type': 'playlist'
+        }
+        result.update(self._pictures('picture', 'playlist', playlist_id))
+        return result
+
+    @staticmethod
+    def _page(make, total, query):
+        index = int(query.get('index', 0))
+        limit = int(query.get('limit', 25))
+        return {'data': [make(i) for i in range(index, min(total, index + limit))], 'total': total}
+
+    def respond(self, path, query):
+        """json response for the api path or None if it is unknown"""
+        parts = path.strip('/').split('/')
+        if parts == ['smarttv', 'streaming.php']:
+            return 'http://stream/%s' % query.get('track_id')
+        kind, item_id, sub = (parts + [None, None])[:3]
+        if kind == 'chart':
+            return {'albums': self._page(self.album, 2000, query)}
+        if kind == 'album':
+            result = self.album(item_id)
+            result['tracks'] = {'data': [self.track(int(item_id) * 100 + i, i + 1) for i in range(self.album_size)]}
+            return result
+        if kind == 'artist' and sub == 'albums':
+            return self._page(self.album, self.artist_albums, query)
+        if kind == 'artist' and sub == 'playlists':
+            return self._page(self.playlist, self.artist_albums, query)
+        if kind == 'artist':
+            return self.artist(item_id)
+        if kind == 'playlist' and sub == 'tracks':
+            return self._page(self.track, self.playlist_length, query)
+        if kind == 'playlist':
+            result = self.playlist(item_id)
+            tracks = min(self.playlist_length, self.EMBEDDED_TRACKS)
+            result['tracks'] = {'data': [self.track(i) for i in range(tracks)]}
+            return result
+        if kind == 'track':
+            return self.track(item_id)
+        if kind == 'search':
+            make = {'artist': self.artist, 'album': self.album, 'track': self.track,
+                    'playlist': self.playlist}.get(item_id, self.artist)
+            return self._page(make, self.search_results, query)
+        if kind == 'user' and item_id == 'me':
+            return {'id': 'bench-user', 'name': 'Bench User'}
+        if kind == 'user':
+            make = {'artists': self.artist, 'albums': self.album, 'playlists': self.playlist}.get(sub)
+            if make:
+                return self._page(make, self.library_size, query)
+        return None
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        result = server.catalogue.respond(url.path, query)
+        if result is None:
+            self.send_error(404)
+            return
+        body = result if isinstance(result, str) else json.dumps(result)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubApiServer(ThreadingMixIn, HTTPServer):
+    """Local http server standing in for api.deezer.com with latency and jitter in seconds"""
+
+    daemon_threads = True
+
+    def __init__(self, catalogue, latency=0.0, jitter=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.catalogue = catalogue
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%i' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class StubTransport(Transport):
+    """Transport sending the requests for the deezer hosts to the stub server"""
+
+    def __init__(self, base_url, **kwargs):
+        Transport.__init__(self, **kwargs)
+        self._base_url = base_url
+
+    def get(self, url, params=None, timeout=None, idempotent=True):
+        return Transport.get(self, API_HOSTS.sub(self._base_url, url), params, timeout, idempotent)
+
+class BenchmarkFrontend(Frontend):
+    """Frontend counting the rendered items"""
+
+    def __init__(self, settings, profile_dir=None):
+        Frontend.__init__(self)
+        self._settings = settings
+        self._profile_dir = profile_dir
+        self.items = 0
+
+    def get_setting(self, name):
+        return self._settings.get(name, '')
+
+    def set_setting(self, name, value):
+        self._settings[name] = value
+
+    def get_profile_dir(self):
+        return self._profile_dir
+
+    def get_keyboard_input(self, message):
+        return 'artist'
+
+    def render(self, items, hints=None):
+        for _ in items:
+            self.items += 1
+
+    def notify(self, message):
+        pass
+
+    def resolve(self, url):
+        pass
+
+    def run_background(self, params):
+        pass
+
+def run_mode(base_url, query, settings, profile_dir=None):
+    """render query once and return the measurements of this process"""
+    start = time.time()
+    frontend = BenchmarkFrontend(settings, profile_dir)
+    backend = DeezerBackend(frontend, transport=StubTransport(base_url))
+    Addon(backend, frontend).render(query)
+    return {
+        'seconds': time.time() - start,
+        'items': frontend.items,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+def deep_size(root):
+    """bytes of the object and everything it references, shared objects counted once"""
+    seen = set()
+    size = 0
+    pending = [root]
+    while pending:
+        value = pending.pop()
+        if id(value) in seen or value is None:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            pending.extend(value.keys())
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+        else:
+            for cls in type(value).__mro__:
+                for name in cls.__dict__.get('__slots__', ()):
+                    if name != '__weakref__':
+                        pending.append(getattr(value, name, None))
+    return size
+
+def item_memory(tracks=5000):
+    """bytes held by the items of a playlist as records and as the dicts they replaced"""
+    catalogue = Catalogue(playlist_length=tracks)
+    data = [catalogue.track(index) for index in range(tracks)]
+    backend = DeezerBackend(BenchmarkFrontend({'user_id': 'bench-user', 'response_cache': 'false'}))
+    records = [backend._extract_track(track, -1, backend._extract_album_data(track['album'], track['artist']))
+               for track in data]
+    dicts = []
+    for track, record in zip(data, records):
+        # the album fields were copied out of the response of every track
+        item = dict(record.items())
+        item.update({
+            'album': track['album']['title'],
+            'artist': track['artist']['name'],
+            'thumb': track['album'].get('cover_big'),
+            'year': track['release_date'][:4],
+            'track_count': track['album'].get('nb_tracks')
+        })
+        dicts.append(item)
+    return {'tracks': tracks, 'records_kb': deep_size(records) // 1024, 'dicts_kb': deep_size(dicts) // 1024}
+
+ROUTING_QUERY = '?mode=artist_albums&artist_id=1&page=2&like=False&all_items=true'
+
+def _inspected_mode():
+    import inspect
+    return inspect.currentframe().f_back.f_code.co_name
+
+def artist_albums(artist_id, page=0, like=None, all_items=None):
+    """the arguments handling of a mode before the route table, its strings converted on every use
+    and the mode of the next page found by frame inspection"""
+    like = True if like == 'True' else None if like is None else False
+    all_items = all_items == 'true'
+    return {'mode': _inspected_mode(), 'artist_id': artist_id, 'page': int(page) + 1, 'like': like}
+
+def _parse(query):
+    args = parse_qs(query[1:])
+    return dict((key, values[0]) for key, values in args.items())
+
+def routing(iterations=20000, query=ROUTING_QUERY):
+    """microseconds per dispatch of the query through getattr and through the route table,
+    both building the target of the next page"""
+    backend = DeezerBackend(BenchmarkFrontend({'user_id': 'bench-user', 'response_cache': 'false'}))
+    module = sys.modules[__name__]
+
+    def legacy():
+        args = _parse(query)
+        return getattr(module, args.pop('mode'))(**args)
+
+    def routed():
+        args = _parse(query)
+        route = backend.routes().get(args.pop('mode'))
+        args = route.convert(args)[0]
+        return backend.target(route.mode, artist_id=args['artist_id'], page=args['page'] + 1, like=args['like'])
+
+    result = {'iterations': iterations}
+    for name, dispatch in (('getattr_us', legacy), ('routes_us', routed)):
+        start = time.time()
+        for _ in range(iterations):
+            dispatch()
+        result[name] = (time.time() - start) * 1e6 / iterations
+    return result
+
+def run(server, settings, modes=MODES, repeat=1, cache=False):
+    """render every mode in a child process, returns {mode: measurements}"""
+    results = {}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name, query in modes:
+        runs = []
+        profile_dir = tempfile.mkdtemp() if cache else ''
+        try:
+            for _ in range(repeat):
+                requests_before = server.requests
+                output = subprocess.check_output([
+                    sys.executable, '-m', 'lib.benchmark', '--child', query,
+                    '--api', server.url, '--settings', json.dumps(settings), '--profile', profile_dir
+                ], cwd=root)
+                measurement = json.loads(output.splitlines()[-1])
+                measurement['requests'] = server.requests - requests_before
+                runs.append(measurement)
+        finally:
+            if profile_dir:
+                shutil.rmtree(profile_dir)
+        # the fastest run is the least disturbed by the machine
+        results[name] = min(runs, key=lambda measurement: measurement['seconds'])
+    return results
+
+def compare(results, baseline, tolerance):
+    """lines describing the changes against the baseline, regressions beyond tolerance are flagged"""
+    lines = []
+    regressions = 0
+    for name, _ in MODES:
+        if name not in results or name not in baseline:
+            continue
+        for metric in METRICS:
+            old, new = baseline[name][metric], results[name][metric]
+            change = (new - old) / float(old) if old else 0.0
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions += 1
+            lines.append('%-14s %-9s %12.3f -> %12.3f  %+7.1f%%%s' % (name, metric, old, new, change * 100, flag))
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--album-size', type=int, default=15, help='tracks per album')
+    parser.add_argument('--playlist-length', type=int, default=100, help='tracks per playlist')
+    parser.add_argument('--library-size', type=int, default=100, help='favourite artists, albums and playlists')
+    parser.add_argument('--latency', type=float, default=0, help='latency per request in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra latency per request in ms')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per mode, the fastest is reported')
+    parser.add_argument('--cache', action='store_true', help='keep the profile (and its caches) between runs')
+    parser.add_argument('--mode', action='append', help='only run these modes')
+    parser.add_argument('--save', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative increase reported as regression')
+    parser.add_argument('--memory', type=int, metavar='TRACKS',
+                        help='only compare the memory of a playlist of this length as records and as dicts')
+    parser.add_argument('--routing', type=int, metavar='ITERATIONS',
+                        help='only compare the time to dispatch a url through getattr and through the route table')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--api', help=argparse.SUPPRESS)
+    parser.add_argument('--settings', default='{}', help=argparse.SUPPRESS)
+    parser.add_argument('--profile', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(run_mode(args.api, args.child, json.loads(args.settings), args.profile)))
+        return 0
+    if args.memory:
+        result = item_memory(args.memory)
+        print('%(tracks)i tracks: %(records_kb)i kB as records, %(dicts_kb)i kB as dicts' % result)
+        return 0
+    if args.routing:
+        result = routing(args.routing)
+        print('%(iterations)i dispatches: %(getattr_us).1f us through getattr, %(routes_us).1f us through routes' % result)
+        return 0
+
+    catalogue = Catalogue(args.album_size, args.playlist_length, args.library_size)
+    server = StubApiServer(catalogue, args.latency / 1000.0, args.jitter / 1000.0).start()
+    settings = {'access_token': 'bench-token', 'user_id': 'bench-user', 'response_cache': 'false'}
+    if args.cache:
+        settings['response_cache'] = 'true'
+    modes = [(name, query) for name, query in MODES if not args.mode or name in args.mode]
+    try:
+        results = run(server, settings, modes, args.repeat, args.cache)
+    finally:
+        server.stop()
+
+    print('%-14s %9s %9s %9s %9s' % ('mode', 'requests', 'items', 'ms', 'peak kB'))
+    for name, _ in modes:
+        result = results[name]
+        print('%-14s %9i %9i %9.1f %9i' % (
+            name, result['requests'], result['items'], result['seconds'] * 1000, result['peak_kb']))
+    if args.save:
+        with open(args.save, 'w') as result_file:
+            json.dump(results, result_file, indent=4, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            lines, regressions = compare(results, json.load(baseline_file), args.tolerance)
+        print('\n'.join(lines))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
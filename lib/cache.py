@@ -0,0 +1,136 @@
+"""Persistent caches shared between plugin invocations"""
+
+import hashlib
+import json
+import os
+import time
+from lib.files import atomic_write, makedirs, remove
+
+class DiskCache(object):
+    """Key value store keeping one json file per entry in a directory.
+
+    Entries expire after their ttl, the least recently used ones are evicted
+    once max_entries or max_bytes is exceeded. Files are written to a
+    temporary name and renamed into place, so concurrent plugin processes
+    never read a partially written entry."""
+
+    SUFFIX = '.json'
+
+    def __init__(self, directory, max_entries=None, max_bytes=None):
+        self._directory = directory
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        makedirs(directory)
+
+    def _path(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return os.path.join(self._directory, hashlib.sha1(key).hexdigest() + self.SUFFIX)
+
+    def get_entry(self, key):
+        """Return (value, age, ttl) of the entry regardless of its expiry or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = json.loads(entry_file.read().decode('utf-8'))
+            if entry['key'] != key:
+                return None
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        except (ValueError, KeyError, TypeError):
+            remove(path)
+            return None
+        return entry['value'], time.time() - entry['stored'], entry['ttl']
+
+    def get(self, key):
+        """Return the value stored for key or None if it is missing or expired"""
+        entry = self.get_entry(key)
+        if entry is None or entry[1] > entry[2]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds"""
+        content = json.dumps({'key': key, 'stored': time.time(), 'ttl': ttl, 'value': value})
+        atomic_write(self._path(key), content.encode('utf-8'))
+        self._evict()
+
+    def lease(self, key, seconds):
+        """Mark the entry as being refreshed for seconds, False if it already is or is missing.
+
+        The lease is kept apart from the time the entry was stored, so an
+        entry that is never refreshed still expires."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = json.loads(entry_file.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return False
+        now = time.time()
+        if entry.get('key') != key or entry.get('leased_until', 0) > now:
+            return False
+        entry['leased_until'] = now + seconds
+        atomic_write(path, json.dumps(entry).encode('utf-8'))
+        return True
+
+    def values(self):
+        """the values of all entries regardless of their expiry"""
+        for name in os.listdir(self._directory):
+            if name.endswith(self.SUFFIX):
+                try:
+                    with open(os.path.join(self._directory, name), 'rb') as entry_file:
+                        yield json.loads(entry_file.read().decode('utf-8'))['value']
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+
+    def delete_where(self, matches):
+        """delete the entries whose key matches, returns how many were deleted"""
+        deleted = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                with open(path, 'rb') as entry_file:
+                    key = json.loads(entry_file.read().decode('utf-8'))['key']
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+            if matches(key):
+                remove(path)
+                deleted += 1
+        return deleted
+
+    def delete(self, key):
+        remove(self._path(key))
+
+    def clear(self):
+        for name in os.listdir(self._directory):
+            remove(os.path.join(self._directory, name))
+
+    def _evict(self):
+        if self._max_entries is None and self._max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self._directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        count = len(entries)
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in entries:
+            if (self._max_entries is None or count <= self._max_entries) and \
+                    (self._max_bytes is None or size <= self._max_bytes):
+                break
+            remove(os.path.join(self._directory, name))
+            count -= 1
+            size -= entry_size
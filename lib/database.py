@@ -0,0 +1,33 @@
+"""Sqlite databases in the profile, shared by plugin processes and threads"""
+
+import sqlite3
+import threading
+
+class Database(object):
+    """Opens the database at path on first use, subclasses create their tables in SCHEMA.
+
+    sqlite connections can't be used from another thread than the one that
+    opened them, so every thread, e.g. the prefetch thread, gets its own."""
+
+    SCHEMA = ''
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # plugin processes wait for each other instead of failing
+            connection = sqlite3.connect(self._path, timeout=10)
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """close the connection of the calling thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -1,56 +1,261 @@
 # coding=UTF-8
 """"Deezer Backend"""
 
-import inspect
 import json
-from random import shuffle
-import requests
+import os
+import re
+import sqlite3
+import time
+import urllib
+import urlparse
+from functools import partial
 from lib.addon import Backend
+from lib.cache import DiskCache
+from lib.items import AlbumRef, Entry, Track
+from lib.library import Library
+from lib.prefetch import Prefetcher
+from lib.ratelimit import RateLimiter
+from lib.resilience import CircuitBreaker, CircuitOpen, Latencies, Resilience
+from lib.search_index import SearchIndex
+from lib.shuffle import Permutation, new_seed
+from lib.transport import Transport
+from lib.workers import parallel_map
 
 class DeezerBackend(Backend):
     """Deezer backend"""
 
-    ALBUM_TRACK_COUNT = 'track_count'
     API_STREAMING_URL = 'http://tv.deezer.com/smarttv/streaming.php'
+    # the only host revalidate() requests, the access token must not leave it
+    API_HOST = 'api.deezer.com'
+    # seconds requests to an endpoint may take including retries, None is the http_timeout setting
+    LATENCY_BUDGETS = (
+        ('stream', re.compile(r'/smarttv/streaming\.php$'), 6),
+        ('search', re.compile(r'^/search/'), 6),
+        ('api', re.compile(r''), None),
+    )
+    # image sizes of the api from small to large
+    IMAGE_SIZES = ('small', 'medium', 'big', 'xl')
+    # answers of the streaming api worth caching, error pages and payloads are not
+    STREAM_URL = re.compile(r'^\s*https?://\S+\s*$')
+    # error code of the api when the request quota of the token is used up
+    QUOTA_ERROR = 4
+    # seconds a response is fresh and how long it may be served stale afterwards
+    # while it is refreshed in the background, first matching url pattern wins
+    RESPONSE_TTLS = (
+        (re.compile(r'/user/me$'), 0, 0),
+        (re.compile(r'/user/'), 5 * 60, 24 * 60 * 60),
+        (re.compile(r'/chart/'), 30 * 60, 24 * 60 * 60),
+        (re.compile(r'/search/'), 60 * 60, 24 * 60 * 60),
+        (re.compile(r'/playlist/'), 60 * 60, 7 * 24 * 60 * 60),
+        (re.compile(r'/artist/'), 24 * 60 * 60, 7 * 24 * 60 * 60),
+        (re.compile(r'/(album|track)/'), 7 * 24 * 60 * 60, 30 * 24 * 60 * 60),
+    )
+    # seconds other invocations keep using a stale response while it is refreshed
+    REVALIDATION_LEASE = 60
+    # tracks per request when loading a complete playlist
+    PLAYLIST_WINDOW = 100
+    # kinds searched at once by search_all with their section titles
+    SEARCH_SECTIONS = (('artist', 'Artists'), ('album', 'Albums'), ('track', 'Tracks'), ('playlist', 'Playlists'))
+    SEARCH_SECTION_SIZE = 5
+    # search hits from the local index shown before the remote results
+    LOCAL_RESULTS = 10
+    LOCAL_MARK = u'★ '
+    # favourites read per request when the library is synced
+    LIBRARY_WINDOW = 100
+    # assumed number of chart entries if the api does not tell
+    CHART_SIZE = 2000
+    # kodi content type and whether kodi may keep the listing of a mode, listings
+    # of catalogue items can't change, charts and favourites can
+    DIRECTORY_HINTS = {
+        'album': ('songs', True),
+        'track': ('songs', True),
+        'playlist': ('songs', False),
+        'artist': ('files', True),
+        'artist_albums': ('albums', True),
+        'artist_playlists': ('albums', True),
+        'albums': ('albums', False),
+        'my_albums': ('albums', False),
+        'my_playlists': ('albums', False),
+        'my_artists': ('artists', False),
+        'search': ('artists', False),
+        'search_all': ('files', False),
+    }
+    # modes started by the addon in the background, they don't navigate and leave prefetching running
+    BACKGROUND_MODES = ('revalidate', 'sync_library')
+    # modes whose responses are warmed when their entries are on screen
+    PREFETCH_MODES = ('albums', 'album', 'playlist', 'artist_albums', 'artist_playlists',
+                      'my_artists', 'my_albums', 'my_playlists', 'search')
+    # modes reachable through urls, other methods can't be called from outside
+    ROUTES = {
+        'search': {'query': str, 'page': int, 'all_items': bool, 'kind': str},
+        'search_all': {'query': str},
+        'albums': {'page': int, 'all_items': bool},
+        'my_artists': {'page': int, 'like': bool, 'all_items': bool, 'sort': str},
+        'my_albums': {'page': int, 'like': bool, 'all_items': bool, 'sort': str},
+        'my_playlists': {'page': int, 'like': bool, 'all_items': bool, 'sort': str},
+        'remove_likes': {},
+        'playlist': {'playlist_id': str, 'shuffle': bool, 'page': int, 'seed': int},
+        'album': {'album_id': str},
+        'artist': {'artist_id': str, 'like': bool},
+        'artist_albums': {'artist_id': str, 'page': int, 'like': bool, 'all_items': bool},
+        'artist_playlists': {'artist_id': str, 'page': int, 'like': bool, 'all_items': bool},
+        'track': {'track_id': str},
+        'play': {'track_id': str, 'next_track_id': str},
+        'like_artist': {'artist_id': str},
+        'like_album': {'album_id': str},
+        'like_playlist': {'playlist_id': str},
+        'unlike_artist': {'artist_id': str},
+        'unlike_album': {'album_id': str},
+        'unlike_playlist': {'playlist_id': str},
+        'like_all': {'kind': str, 'ids': str},
+        'unlike_all': {'kind': str, 'ids': str},
+        'revalidate': {'url': str, 'params': str, 'auth': bool},
+        'sync_library': {'kind': str},
+        'resync_library': {},
+        'rebuild_search_index': {},
+        'clear_cache': {},
+    }
 
-    def __init__(self, frontend, requester=None):
+    def __init__(self, frontend, requester=None, transport=None):
         # http://requests-oauthlib.readthedocs.io/en/latest/oauth2_workflow.html
         Backend.__init__(self, frontend)
+        self._requester = requester if requester else self
+        self._response_cache = None
+        self._stream_url_cache = None
+        self._playlist_cache = None
+        self._search_index = None
+        self._generation = None
+        self.prefetch_thread = None
+        profile_dir = frontend.get_profile_dir()
+        self._profile_dir = profile_dir
+        if profile_dir and frontend.get_setting('response_cache') != 'false':
+            self._response_cache = DiskCache(
+                os.path.join(profile_dir, 'responses'),
+                max_bytes=self._int_setting('response_cache_size', 20) * 1024 * 1024)
+            # track lists of the recently opened playlists with the seeds of their shuffles
+            self._playlist_cache = DiskCache(os.path.join(profile_dir, 'playlists'), max_entries=20)
+        self._serve_stale = frontend.get_setting('stale_while_revalidate') != 'false'
+        self._prefetch_budget = 0
+        if frontend.get_setting('prefetch') != 'false':
+            self._prefetch_budget = self._int_setting('prefetch_budget', 6)
+        self._prefetch_entries = self._int_setting('prefetch_entries', 3)
+        self._workers = self._int_setting('http_workers', 4)
+        self._page_size = max(self._int_setting('page_size', 20), 1)
+        self._all_items_default = frontend.get_setting('all_items') == 'true'
+        self._playlist_page_size = max(self._int_setting('playlist_page_size', 500), 0)
+        self._shuffle_default = frontend.get_setting('shuffle_playlists') != 'false'
+        self._rate_limiter = None
+        if profile_dir and self._int_setting('rate_limit', 10) > 0:
+            self._rate_limiter = RateLimiter(
+                profile_dir, self._int_setting('rate_limit', 10), self._int_setting('rate_limit_burst', 50))
+        self._timeout = self._int_setting('http_timeout', 10)
+        self._resilience = None
+        self._latencies = None
+        if profile_dir and frontend.get_setting('resilience') != 'false':
+            self._latencies = Latencies(profile_dir)
+            self._resilience = Resilience(
+                CircuitBreaker(profile_dir, self._int_setting('circuit_threshold', 5), self._int_setting('circuit_cooldown', 30)),
+                self._latencies,
+                retries=self._int_setting('http_retries', 2))
+        # the resilience layer retries with jitter instead of the transport
+        self._transport = transport if transport else Transport(
+            timeout=self._timeout,
+            retries=0 if self._resilience else self._int_setting('http_retries', 2),
+            pool_size=self._workers)
         self._access_token = frontend.get_setting('access_token')
         self._user_id = frontend.get_setting('user_id')
         self._stream_url = frontend.get_setting('stream_url')
         if self._user_id == '' and self._access_token != '':
-            self._user_id = self._load_json('http://api.deezer.com/user/me', {'access_token': self._access_token})['id']
-            # todo: safe user id in settings
+            self._user_id = str(self._load_json('http://api.deezer.com/user/me', {'access_token': self._access_token})['id'])
+            frontend.set_setting('user_id', self._user_id)
         self.log('user id is %s' % self._user_id)
         self.log('token is %s' % self._access_token)
         self.log('stream url is %s' % self._stream_url)
-        self._requester = requester if requester else self
+        self._proxy_port = None
+        if frontend.get_setting('stream_proxy') == 'true':
+            self._proxy_port = self._int_setting('stream_proxy_port', 52341)
+        self._library = None
+        if profile_dir and frontend.get_setting('library') != 'false' and self._user_id:
+            self._library = Library(os.path.join(profile_dir, 'library.db'))
+        if profile_dir and frontend.get_setting('search_index') != 'false':
+            self._search_index = SearchIndex(
+                os.path.join(profile_dir, 'search.db'), self._int_setting('search_index_size', 5000))
+        self._library_interval = self._int_setting('library_sync_interval', 60) * 60
+        self._library_sort = frontend.get_setting('library_sort') or 'added'
+        self._thumb_size = self._size_setting('thumb_size', 'medium')
+        self._fanart_size = self._size_setting('fanart_size', 'big')
+        self._stream_url_ttl = self._int_setting('stream_url_cache_ttl', 30) * 60
+        if profile_dir and self._stream_url_ttl > 0:
+            self._stream_url_cache = DiskCache(
+                os.path.join(profile_dir, 'stream_urls'),
+                max_entries=self._int_setting('stream_url_cache_size', 500))
 
-    def load_from_url(self, url, params={}):
+    def _size_setting(self, name, default):
+        size = self._frontend.get_setting(name)
+        return size if size in self.IMAGE_SIZES else default
+
+    def _latency_budget(self, url):
+        """(endpoint, seconds) the requests of the url may take including retries"""
+        path = urlparse.urlparse(url).path
+        for endpoint, pattern, budget in self.LATENCY_BUDGETS:
+            if pattern.search(path):
+                return endpoint, budget or self._timeout
+        return 'api', self._timeout
+
+    def _api_get(self, url, params={}, idempotent=True):
+        """GET through the shared rate limit and the resilience layer, once more after a quota error"""
+        def send(timeout):
+            if self._rate_limiter:
+                delay = self._rate_limiter.acquire()
+                if delay > 0:
+                    self.log('throttled %s for %.0f ms' % (url, delay * 1000))
+            return self._transport.get(url, params, timeout, idempotent)
+
+        for _ in range(2):
+            if self._resilience:
+                endpoint, budget = self._latency_budget(url)
+                response = self._resilience.get(send, url, endpoint, budget, idempotent)
+            else:
+                response = send(None)
+            if not self._rate_limiter or not self._quota_exceeded(response):
+                break
+            self.log('request quota exceeded, backing off %.1f s' % self._rate_limiter.quota_exceeded())
+        return response
+
+    def _quota_exceeded(self, response):
+        if response.status_code != 200 or not response.content.startswith('{"error"'):
+            return False
+        try:
+            return json.loads(response.content)['error'].get('code') == self.QUOTA_ERROR
+        except (ValueError, KeyError, AttributeError):
+            return False
+
+    def _load_response(self, url, params={}):
         self._frontend.log('loading ' + url)
-        content = requests.get(url, params=params).text
-        self.log('loaded: ' + content[:40] + '...')
-        return content
+        with self._frontend.tracer.span('http', url=url) as span:
+            response = self._api_get(url, params)
+            span['status'] = response.status_code
+            span['bytes'] = len(response.content)
+        self.log('loaded: ' + response.text[:40] + '...')
+        return response
+
+    def load_from_url(self, url, params={}):
+        return self._load_response(url, params).text
 
     def load_json(self, url, params={}):
         content = self.load_from_url(url, params)
-        return json.loads(content)
+        with self._frontend.tracer.span('json', url=url):
+            return json.loads(content)
 
-    def _to_boolean(self, x):
-        if x == 'True' or x is True:
-            return True
-        if x == None:
-            return None
-        return False
+    def load_json_many(self, urls, params={}):
+        """Loads independent urls concurrently, the results keep the order of the urls"""
+        with self._frontend.tracer.span('batch', urls=len(urls)):
+            return parallel_map(lambda url: self.load_json(url, params), urls, self._workers)
 
     def _ternary(self, bool_or_none, true_val, false_val, none_val):
-        b = self._to_boolean(bool_or_none)
-        if b is True:
-            return true_val
-        if b is False:
-            return false_val
-        return none_val
+        if bool_or_none is None:
+            return none_val
+        return true_val if bool_or_none else false_val
 
     def _like(self, bool, text):
         return self._ternary(
@@ -60,15 +265,230 @@ class DeezerBackend(Backend):
             text
         )
 
+    def _response_ttl(self, url):
+        """(ttl, max stale age) of responses of the provided url"""
+        path = url.split('?', 1)[0]
+        for pattern, ttl, max_stale in self.RESPONSE_TTLS:
+            if pattern.search(path):
+                return ttl, max_stale
+        return 0, 0
+
+    @staticmethod
+    def _cache_key(url, params):
+        params = sorted((key, value) for key, value in params.items() if key != 'access_token')
+        return url + '#' + urllib.urlencode(params)
+
     def _load_json(self, url, params={}):
         """Loads the content from the provided url and parse it as json"""
-        return self._requester.load_json(url, params)
+        return self._load_json_many([url], params)[0]
+
+    def _load_json_many(self, urls, params={}):
+        """Loads the content of several urls concurrently and parse it as json"""
+        results = [self._cached_response(url, params) for url in urls]
+        missing = [index for index, data in enumerate(results) if data is None]
+        loaded = []
+        prefetcher = Prefetcher.running()
+        if missing and prefetcher:
+            prefetcher.spend(len(missing))
+        try:
+            if len(missing) == 1:
+                loaded = [self._requester.load_json(urls[missing[0]], params)]
+            elif missing:
+                loaded = self._requester.load_json_many([urls[index] for index in missing], params)
+        except CircuitOpen as error:
+            for index in missing:
+                results[index] = self._outdated_response(urls[index], params, error)
+            return results
+        for index, data in zip(missing, loaded):
+            results[index] = self._store_response(urls[index], params, data)
+            if self._search_index:
+                self._search_index.collect(data)
+            if prefetcher:
+                prefetcher.keys.append(self._cache_key(urls[index], params))
+        return results
+
+    def _outdated_response(self, url, params, error):
+        """cached response of any age while the api is not asked, raises the error if there is none"""
+        entry = self._response_cache.get_entry(self._cache_key(url, params)) if self._response_cache else None
+        if entry is None:
+            raise error
+        self.log('%s, serving %.0f s old response of %s' % (error, entry[1], url))
+        return entry[0]
+
+    def _cached_response(self, url, params):
+        """cached response of the url, stale ones are revalidated in the background"""
+        ttl, max_stale = self._response_ttl(url)
+        if self._response_cache is None or ttl <= 0:
+            return None
+        key = self._cache_key(url, params)
+        entry = self._response_cache.get_entry(key)
+        if entry is None:
+            return None
+        data, age, entry_ttl = entry
+        if age <= entry_ttl:
+            self.log('response cache hit for ' + key)
+            if not Prefetcher.running():
+                self._count_prefetch_hit(key)
+            return data
+        if self._serve_stale and age - entry_ttl <= max_stale:
+            self.log('serving stale %s (expired %is ago)' % (key, age - entry_ttl))
+            if not self._response_cache.lease(key, self.REVALIDATION_LEASE):
+                # another invocation is revalidating it
+                return data
+            self._frontend.run_background({
+                self.MODE: self.revalidate.__name__,
+                'url': url,
+                'params': json.dumps(dict((k, v) for k, v in params.items() if k != 'access_token')),
+                'auth': 'access_token' in params
+            })
+            return data
+        return None
+
+    def _store_response(self, url, params, data):
+        ttl = self._response_ttl(url)[0]
+        if self._response_cache and ttl > 0 and not (isinstance(data, dict) and 'error' in data):
+            self._response_cache.set(self._cache_key(url, params), data, ttl)
+        return data
+
+    def _count_prefetch_hit(self, key):
+        stats = Prefetcher.hit(self._profile_dir, key)
+        if stats:
+            self.log('prefetch hit for %s (%i of %i prefetched responses used)' % ((key,) + stats))
+
+    def directory_hints(self, mode, args):
+        content, cache = self.DIRECTORY_HINTS.get(mode, ('files', mode is None))
+        return {
+            'content': content,
+            'cache': cache,
+            # later pages replace the previous page, back leads to the parent menu
+            'update_listing': args.get('page', 0) > 0
+        }
+
+    def _hint_page_items(self, page, total, all_items):
+        """tell the frontend how many entries a paged listing will have"""
+        remaining = max(int(total) - page * self._page_size, 0)
+        if all_items:
+            self._frontend.set_total_items(remaining)
+        else:
+            self._frontend.set_total_items(min(remaining, self._page_size) + (1 if remaining > self._page_size else 0))
+
+    def finish(self):
+        """write the response times and the items seen in the responses of this invocation"""
+        if self._latencies:
+            try:
+                self._latencies.save()
+            except IOError as error:
+                self.log('response times not saved: %s' % error)
+        if self._search_index:
+            try:
+                with self._frontend.tracer.span('index') as span:
+                    span['items'] = self._search_index.flush()
+            except sqlite3.Error as error:
+                self.log('search index not updated: %s' % error)
+            finally:
+                self._search_index.close()
+
+    def rebuild_search_index(self):
+        """Index everything in the response cache and the library again"""
+        if not self._search_index:
+            return
+        self._search_index.clear()
+        if self._response_cache:
+            for data in self._response_cache.values():
+                self._search_index.collect(data)
+        if self._library:
+            for kind in Library.KINDS:
+                self._search_index.collect(self._library.items(kind))
+        self.log('search index rebuilt with %i items' % self._search_index.flush())
+
+    def navigate(self, mode):
+        if self._response_cache and mode not in self.BACKGROUND_MODES:
+            self._generation = Prefetcher.navigated(self._profile_dir)
+
+    def prefetch(self, items):
+        """Warm the response cache for the next page and the first entries in the background"""
+        if not self._generation or self._prefetch_budget <= 0:
+            return
+        targets = self._prefetch_targets(items)
+        if targets:
+            prefetcher = Prefetcher(self._profile_dir, self._generation, self._prefetch_budget, self.log, self.finish)
+            self.prefetch_thread = prefetcher.start([partial(self._prefetch_target, target) for target in targets])
+
+    def stop_prefetch(self):
+        """cancel the prefetching of the previous invocation and wait for it"""
+        if self.prefetch_thread:
+            if self._generation:
+                self._generation = Prefetcher.navigated(self._profile_dir)
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
+
+    def _prefetch_target(self, target):
+        args = dict(target)
+        route = self.routes().get(args.pop(self.MODE))
+        list(getattr(self, route.mode)(**route.convert(args)[0]))
+
+    def _prefetch_targets(self, items):
+        """targets of the next page first, then of the first entries"""
+        pages = []
+        entries = []
+        for item in items:
+            target = dict(item.get(self.TARGET) or {})
+            if target.get(self.MODE) == self.artist.__name__:
+                target = {self.MODE: self.artist_albums.__name__, 'artist_id': target['artist_id']}
+            if target.get(self.MODE) not in self.PREFETCH_MODES:
+                continue
+            if target[self.MODE] == self.search.__name__ and not target.get('query'):
+                continue
+            if 'seed' in target and 'page' not in target:
+                # a reshuffle replaces the stored order, only the user asks for it
+                continue
+            if 'page' in target:
+                pages.append(target)
+            elif len(entries) < self._prefetch_entries:
+                entries.append(target)
+        return pages + entries
+
+    def revalidate(self, url, params='{}', auth=False):
+        """Refresh a cached response, started in the background for stale responses"""
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or parts.hostname != self.API_HOST:
+            raise ValueError('not an api url: %s' % url)
+        params = json.loads(params)
+        if auth:
+            params['access_token'] = self._access_token
+        if self._response_cache:
+            self._store_response(url, params, self._requester.load_json(url, params))
+            self.log('revalidated ' + url)
+
+    def clear_cache(self):
+        """Drop all cached responses, playlists and stream urls"""
+        for cache in (self._response_cache, self._playlist_cache, self._stream_url_cache):
+            if cache:
+                cache.clear()
+        self.log('cache cleared')
 
     def load(self, url, params={}):
-        self._frontend.log('loading ' + url)
-        content = requests.get(url, params=params).text
-        self.log('loaded: ' + content[:40] + '...')
-        return content
+        """body of the response, IOError unless the api answered with 200"""
+        response = self._load_response(url, params)
+        if response.status_code != 200:
+            raise IOError('%s answered %i' % (url, response.status_code))
+        return response.text
+
+    def _images(self, data, prefix):
+        """(thumb, fanart) urls in the configured sizes, fanart is None if it is the thumb"""
+        sizes = [prefix + '_' + size for size in self.IMAGE_SIZES]
+        available = [size for size in sizes if data.get(size)]
+        if not available:
+            return None, None
+
+        def closest(size):
+            # the configured size, else the next larger one, else the largest there is
+            for name in sizes[self.IMAGE_SIZES.index(size):]:
+                if data.get(name):
+                    return data[name]
+            return data[available[-1]]
+        thumb, fanart = closest(self._thumb_size), closest(self._fanart_size)
+        return thumb, None if fanart == thumb else fanart
 
     def _extract_artist(self, artist, like=None):
         target = {
@@ -77,27 +497,14 @@ class DeezerBackend(Backend):
         }
         if  like != None:
             target['like'] = like
-        return {
-            self.LABEL: self._like(like, artist['name']),
-            self.THUMB: artist['picture_big'],
-            self.TARGET: target
-        }
+        return Entry(self._like(like, artist['name']), target, *self._images(artist, 'picture'))
 
     def _extract_album_data(self, album_data, artist_data):
-        data = {
-            self.ALBUM_NAME: album_data['title'],
-            self.ARTIST: artist_data['name'],
-            self.THUMB: None,
-            self.YEAR: None,
-            self.ALBUM_TRACK_COUNT: None
-        }
-        if 'cover_big' in album_data:
-        	data[self.THUMB] = album_data['cover_big']
-        if 'nb_tracks' in album_data:
-            data[self.ALBUM_TRACK_COUNT] = album_data['nb_tracks']
+        year = None
         if 'release_date' in album_data:
-            data[self.YEAR] = album_data.get('release_date', '')[:4]
-        return data
+            year = album_data.get('release_date', '')[:4]
+        thumb, fanart = self._images(album_data, 'cover')
+        return AlbumRef.get(album_data['title'], artist_data['name'], thumb, year, album_data.get('nb_tracks'), fanart)
 
     def _extract_album(self, album, artist={}, like=None):
         label = self._like(like, album['title'])
@@ -108,37 +515,17 @@ class DeezerBackend(Backend):
         if 'release_date' in album:
             label += ' (%s)' % (album['release_date'][:4])
         function = self._ternary(like, self.like_album, self.unlike_album, self.album)
-        return {
-            self.LABEL: label,
-            self.THUMB: album['cover_big'],
-            self.TARGET: {
-                self.MODE: function.__name__,
-                'album_id': album['id']
-            }
-        }
+        return Entry(label, {self.MODE: function.__name__, 'album_id': album['id']}, *self._images(album, 'cover'))
 
     def _extract_playlist(self, playlist, like=None):
         label = self._like(like, playlist['title'])
         function = self._ternary(like, self.like_playlist, self.unlike_playlist, self.playlist)
-        return {
-            self.LABEL: label,
-            self.THUMB: playlist['picture_big'],
-            self.TARGET: {
-                self.MODE: function.__name__,
-                'playlist_id': playlist['id']
-            }
-        }
+        return Entry(label, {self.MODE: function.__name__, 'playlist_id': playlist['id']}, *self._images(playlist, 'picture'))
 
-    def _next_page(self, page, total, items_per_page, params={}):
-        page = int(page)
+    def _next_page(self, mode, page, total, params={}, size=None):
         next_page = page + 1
-        if int(total) > (next_page * int(items_per_page)):
-            target = inspect.currentframe().f_back.f_code.co_name
-            target_data = {self.MODE: target, 'page': next_page}
-            for key, value in params.items():
-                if (value):
-                    target_data[key] = value
-            yield {self.LABEL: 'page ' + str(next_page + 1), self.TARGET: target_data}
+        if int(total) > next_page * (size or self._page_size):
+            yield Entry('page ' + str(next_page + 1), self.target(mode, page=next_page, **params))
 
     def check_stream_url(self):
         if self._stream_url:
@@ -150,6 +537,7 @@ class DeezerBackend(Backend):
     def root(self):
         """root menu"""
         yield {self.LABEL: 'Search', self.TARGET: {self.MODE: self.search.__name__}}
+        yield {self.LABEL: 'Search everything', self.TARGET: {self.MODE: self.search_all.__name__}}
         yield {self.LABEL: 'Albums', self.TARGET: {self.MODE: self.albums.__name__}}
         if self._user_id:
             yield {self.LABEL: 'My artists', self.TARGET: {self.MODE: self.my_artists.__name__}}
@@ -166,79 +554,322 @@ class DeezerBackend(Backend):
     def _get_me_url(self):
         return 'https://api.deezer.com/user/' + self._user_id
 
-    def my_artists(self, page=0, like=None):
+    def _page_url(self, url, page):
+        """url of the page, url takes the limit and the index"""
+        return url % (self._page_size, page * self._page_size)
+
+    def _all_items(self, all_items):
+        return self._all_items_default if all_items is None else all_items
+
+    def _pages(self, first, url, page, total, all_items, params={}, size=None):
+        """The first response and, in all items mode, all following pages in order.
+
+        The following pages are loaded concurrently, one batch of index windows
+        at a time, so the items of the first batches are rendered while the
+        next ones are loading."""
+        yield first
+        if not all_items:
+            return
+        size = size or self._page_size
+        indexes = range((page + 1) * size, int(total), size)
+        batch = max(self._workers, 1)
+        for start in range(0, len(indexes), batch):
+            for data in self._load_json_many([url % (size, index) for index in indexes[start:start + batch]], params):
+                yield data
+
+    def _favourites(self, kind, page, all_items, sort):
+        """(total, items) of a page of the favourites from the library, synced first if needed"""
+        synced = self._library.synced(kind)
+        if synced is None:
+            self._sync_favourites(kind)
+        elif time.time() - synced > self._library_interval:
+            self._library.touch(kind)
+            self._frontend.run_background({self.MODE: self.sync_library.__name__, 'kind': kind})
+        total = self._library.count(kind)
+        self._hint_page_items(page, total, all_items)
+        offset, limit = (0, None) if all_items else (page * self._page_size, self._page_size)
+        return total, self._library.items(kind, sort or self._library_sort, offset, limit)
+
+    def _sync_favourites(self, kind):
+        url = self._get_me_url() + '/' + kind + '?limit=%i&index=%i'
+
+        def load_pages(indexes):
+            return self._requester.load_json_many(
+                [url % (self.LIBRARY_WINDOW, index) for index in indexes],
+                {'access_token': self._access_token})
+        start = time.time()
+        requests = self._library.sync(kind, load_pages, self.LIBRARY_WINDOW)
+        self.log('synced %s favourites with %i requests in %.0f ms' % (kind, requests, (time.time() - start) * 1000))
+
+    def sync_library(self, kind=None):
+        """Sync the favourites of the kind or of all kinds with the local library"""
+        if self._library:
+            for library_kind in [kind] if kind else Library.KINDS:
+                self._sync_favourites(library_kind)
+
+    def resync_library(self):
+        """Read all favourites again"""
+        if self._library:
+            self._library.clear()
+            self.sync_library()
+
+    @staticmethod
+    def _succeeded(response):
+        """the api answers true on success and an error object otherwise"""
+        return response.status_code == 200 and response.content.strip() == 'true'
+
+    def my_artists(self, page=0, like=None, all_items=None, sort=None):
         """Favorite artists"""
-        url = self._get_me_url() + '/artists?&limit=20&index=%i'
-        data = self._load_json(url % (int(page) * 20), {'access_token': self._access_token})
+        all_items = self._all_items(all_items)
+        if self._library:
+            total, items = self._favourites('artists', page, all_items, sort)
+            items = (self._extract_artist(artist, like=like) for artist in items)
+            for item in self._bulk_likes('artists', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.my_artists.__name__, page, total, {'like': like, 'sort': sort}):
+                    yield next_page
+            return
+        url = self._get_me_url() + '/artists?&limit=%i&index=%i'
+        params = {'access_token': self._access_token}
+        data = self._load_json(self._page_url(url, page), params)
         if 'data' in data:
-            for artist in data['data']:
-                yield self._extract_artist(artist, like=like)
-            for next_page in self._next_page(int(page), int(data['total']), 20, {'like': like}):
-                yield next_page
+            self._hint_page_items(page, data['total'], all_items)
+            items = (self._extract_artist(artist, like=like)
+                     for page_data in self._pages(data, url, page, data['total'], all_items, params)
+                     for artist in page_data.get('data', []))
+            for item in self._bulk_likes('artists', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.my_artists.__name__, page, data['total'], {'like': like}):
+                    yield next_page
 
-    def my_albums(self, page=0, like=None):
+    def my_albums(self, page=0, like=None, all_items=None, sort=None):
         """Favorite albums"""
-        url = self._get_me_url() + '/albums?&limit=20&index=%i'
-        data = self._load_json(url % (int(page) * 20), {'access_token': self._access_token})
+        all_items = self._all_items(all_items)
+        if self._library:
+            total, items = self._favourites('albums', page, all_items, sort)
+            items = (self._extract_album(album, like=like) for album in items)
+            for item in self._bulk_likes('albums', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.my_albums.__name__, page, total, {'like': like, 'sort': sort}):
+                    yield next_page
+            return
+        url = self._get_me_url() + '/albums?&limit=%i&index=%i'
+        params = {'access_token': self._access_token}
+        data = self._load_json(self._page_url(url, page), params)
         if 'data' in data:
-            for album in data['data']:
-                yield self._extract_album(album, like=like)
-            for next_page in self._next_page(int(page), int(data['total']), 20, {'like': like}):
-                yield next_page
+            self._hint_page_items(page, data['total'], all_items)
+            items = (self._extract_album(album, like=like)
+                     for page_data in self._pages(data, url, page, data['total'], all_items, params)
+                     for album in page_data.get('data', []))
+            for item in self._bulk_likes('albums', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.my_albums.__name__, page, data['total'], {'like': like}):
+                    yield next_page
 
-    def my_playlists(self, page=0, like=None):
+    def my_playlists(self, page=0, like=None, all_items=None, sort=None):
         """Favorite playlists"""
-        url = self._get_me_url() + '/playlists?&limit=20&index=%i'
-        data = self._load_json(url % (int(page) * 20), {'access_token': self._access_token})
+        all_items = self._all_items(all_items)
+        if self._library:
+            total, items = self._favourites('playlists', page, all_items, sort)
+            items = (self._extract_playlist(playlist, like=like) for playlist in items)
+            for item in self._bulk_likes('playlists', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.my_playlists.__name__, page, total, {'like': like, 'sort': sort}):
+                    yield next_page
+            return
+        url = self._get_me_url() + '/playlists?&limit=%i&index=%i'
+        params = {'access_token': self._access_token}
+        data = self._load_json(self._page_url(url, page), params)
         if 'data' in data:
-            for playlist in data['data']:
-                yield self._extract_playlist(playlist, like=like)
-            for next_page in self._next_page(int(page), int(data['total']), 20, {'like': like}):
-                yield next_page
+            self._hint_page_items(page, data['total'], all_items)
+            items = (self._extract_playlist(playlist, like=like)
+                     for page_data in self._pages(data, url, page, data['total'], all_items, params)
+                     for playlist in page_data.get('data', []))
+            for item in self._bulk_likes('playlists', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.my_playlists.__name__, page, data['total'], {'like': like}):
+                    yield next_page
 
-    def search(self, query=None, page=0):
-        """Request user input and search for it"""
+    def _search_query(self, query):
+        """the query, asked from the user if missing, utf-8 encoded"""
         if query is None:
             query = self._frontend.get_keyboard_input('Search')
-            if not query:
-                return
-        url = 'http://api.deezer.com/search/artist?q=%s&limit=20&index=%i'
-        data = self._load_json(url % (query.replace(' ', '%20'), int(page) * 20))
+        if isinstance(query, unicode):
+            query = query.encode('utf-8')
+        return query
+
+    def _search_url(self, kind, query):
+        return 'http://api.deezer.com/search/' + kind + '?q=' + urllib.quote(query).replace('%', '%%') + '&limit=%i&index=%i'
+
+    def _extract_search_result(self, kind, data):
+        if kind == 'track':
+            return self._extract_track(data, -1, self._extract_album_data(data['album'], data['artist']))
+        return getattr(self, '_extract_' + kind)(data)
+
+    def search(self, query=None, page=0, all_items=None, kind=None):
+        """Request user input and search for artists or the kind, items seen before are listed first"""
+        if kind is not None and kind not in dict(self.SEARCH_SECTIONS):
+            raise ValueError('unknown kind of search: %s' % kind)
+        query = self._search_query(query)
+        if not query:
+            return
+        all_items = self._all_items(all_items)
+        local = set()
+        if self._search_index and page == 0:
+            for local_kind, data in self._search_index.search(query, self.LOCAL_RESULTS):
+                local.add((local_kind, unicode(data['id'])))
+                yield self._extract_local(local_kind, data)
+        url = self._search_url(kind or 'artist', query)
+        data = self._load_json(self._page_url(url, page))
         if 'data' in data:
-            for artist in data['data']:
-                yield self._extract_artist(artist)
-            for next_page in self._next_page(page, data['total'], 20, {'query': query}):
-                yield next_page
+            self._hint_page_items(page, data['total'], all_items)
+            for page_data in self._pages(data, url, page, data['total'], all_items):
+                for result in page_data.get('data', []):
+                    if (kind or 'artist', unicode(result['id'])) not in local:
+                        yield self._extract_search_result(kind or 'artist', result)
+            if not all_items:
+                for next_page in self._next_page(self.search.__name__, page, data['total'], {'query': query, 'kind': kind}):
+                    yield next_page
+
+    def search_all(self, query=None):
+        """Search artists, albums, tracks and playlists at once.
+
+        The kinds are listed in sections ordered by how well their best hit
+        matches the query, each headed by an entry opening all results of
+        the kind."""
+        query = self._search_query(query)
+        if not query:
+            return
+        kinds = [kind for kind, _ in self.SEARCH_SECTIONS]
+        responses = self._load_json_many([
+            self._search_url(kind, query) % (self.SEARCH_SECTION_SIZE, 0) for kind in kinds
+        ])
+        sections = []
+        for (kind, title), data in zip(self.SEARCH_SECTIONS, responses):
+            results = data.get('data', [])
+            if results:
+                sections.append((-self._search_rank(query, kind, results[0]), len(sections), kind, title, data))
+        sections.sort()
+        for _, _, kind, title, data in sections:
+            yield Entry(u'%s (%s)' % (title, data.get('total', len(data['data']))),
+                        {self.MODE: self.search.__name__, 'query': query, 'kind': kind})
+            for result in data['data']:
+                yield self._extract_search_result(kind, result)
+
+    @staticmethod
+    def _search_rank(query, kind, result):
+        """similarity of the query and the name of the result"""
+        import difflib
+        name = result.get('name') if kind == 'artist' else result.get('title')
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return difflib.SequenceMatcher(None, query.lower(), (name or '').lower()).ratio()
 
-    def albums(self, page=0):
+    def _extract_local(self, kind, data):
+        """entry of a search hit from the local index, marked as such"""
+        if kind == 'track':
+            item = Entry('%s (%s)' % (data['title'], data['artist']['name']),
+                         {self.MODE: self.track.__name__, 'track_id': data['id']}, *self._images(data['album'], 'cover'))
+        else:
+            item = getattr(self, '_extract_' + kind)(data)
+        item.label = self.LOCAL_MARK + item.label
+        return item
+
+    def albums(self, page=0, all_items=None):
         """List top albums"""
-        data = self._load_json('http://api.deezer.com/chart/0?limit=20&index=%i' % (int(page) * 20))
-        for album in data['albums']['data']:
-            yield self._extract_album(album)
-        for next_page in self._next_page(page, 2000, 20):
-            yield next_page
+        all_items = self._all_items(all_items)
+        url = 'http://api.deezer.com/chart/0?limit=%i&index=%i'
+        data = self._load_json(self._page_url(url, page))
+        total = data['albums'].get('total', self.CHART_SIZE)
+        self._hint_page_items(page, total, all_items)
+        for page_data in self._pages(data, url, page, total, all_items):
+            for album in page_data['albums']['data']:
+                yield self._extract_album(album)
+        if not all_items:
+            for next_page in self._next_page(self.albums.__name__, page, total):
+                yield next_page
+
+    def _playlist_tracks(self, playlist_id):
+        """All tracks of the playlist, the windows after the first are loaded concurrently"""
+        url = 'http://api.deezer.com/playlist/' + playlist_id + '/tracks?limit=%i&index=%i'
+        data = self._load_json(url % (self.PLAYLIST_WINDOW, 0))
+        for page_data in self._pages(data, url, 0, data.get('total', 0), True, size=self.PLAYLIST_WINDOW):
+            for track in page_data.get('data', []):
+                yield track
+
+    def _compact_track(self, track):
+        """the fields of a playlist track needed to list it"""
+        album = track['album']
+        return {
+            'id': track['id'],
+            'title': track['title'],
+            'duration': track['duration'],
+            'album': dict((key, value) for key, value in album.items()
+                          if key in ('title', 'release_date', 'nb_tracks') or key.startswith('cover_')),
+            'artist': {'name': track['artist']['name']}
+        }
 
-    def playlist(self, playlist_id):
-        """Display playlist content"""
-        tracks = self._load_json('http://api.deezer.com/playlist/' + playlist_id)['tracks']['data']
-        tracks = [t for t in tracks]
-        shuffle(tracks)
-        for track in tracks:
-            album_data = self._extract_album_data(track['album'], track['artist'])
-            yield self._extract_track(track, -1, album_data, track['artist'])
+    def _playlist_listing(self, playlist_id, seed=None):
+        """(tracks, seed) of the playlist, kept in the playlist cache with the seed of its shuffle"""
+        entry = self._playlist_cache.get_entry(playlist_id) if self._playlist_cache else None
+        tracks, stored_seed = None, None
+        if entry:
+            value, age, ttl = entry
+            stored_seed = value['seed']
+            if age <= ttl:
+                tracks = value['tracks']
+        loaded = tracks is None
+        if loaded:
+            tracks = [self._compact_track(track) for track in self._playlist_tracks(playlist_id)]
+        if seed is None:
+            seed = new_seed() if stored_seed is None else stored_seed
+        if self._playlist_cache and (loaded or seed != stored_seed):
+            ttl = self._response_ttl('http://api.deezer.com/playlist/' + playlist_id + '/tracks')[0]
+            self._playlist_cache.set(playlist_id, {'tracks': tracks, 'seed': seed}, ttl)
+        return tracks, seed
+
+    def playlist(self, playlist_id, shuffle=None, page=0, seed=None):
+        """A window of the playlist in playlist order or shuffled by the seed stored with the playlist"""
+        shuffle = self._shuffle_default if shuffle is None else shuffle
+        tracks, seed = self._playlist_listing(playlist_id, seed if shuffle else None)
+        total = len(tracks)
+        size = self._playlist_page_size or max(total, 1)
+        order = Permutation(total, seed) if shuffle else range(total)
+        start, end = page * size, min((page + 1) * size, total)
+        self._frontend.set_total_items(end - start + (1 if shuffle else 0) + (1 if end < total else 0))
+        for position in range(start, end):
+            track = tracks[order[position]]
+            next_track_id = None
+            if self._proxy_port and position + 1 < total:
+                # lets the streaming proxy prefill the track queued next
+                next_track_id = tracks[order[position + 1]]['id']
+            yield self._extract_track(track, -1, self._extract_album_data(track['album'], track['artist']), next_track_id)
+        if shuffle:
+            yield Entry(u'🔀 Reshuffle', self.target(
+                self.playlist.__name__, playlist_id=playlist_id, shuffle=True, seed=new_seed()))
+        for next_page in self._next_page(self.playlist.__name__, page, total,
+                                         {'playlist_id': playlist_id, 'shuffle': shuffle, 'seed': seed if shuffle else None},
+                                         size):
+            yield next_page
 
     def album(self, album_id):
         """Load album data"""
         album = self._load_json('http://api.deezer.com/album/' + album_id)
         album_data = self._extract_album_data(album, album['artist'])
-        index = 1
-        for track in album['tracks']['data']:
-            yield self._extract_track(track, index, album_data, album['artist'])
-            index = index + 1
+        tracks = album['tracks']['data']
+        self._frontend.set_total_items(len(tracks))
+        for index, track in enumerate(tracks):
+            yield self._extract_track(track, index + 1, album_data, self._next_track_id(tracks, index))
 
     def artist(self, artist_id, like=True):
         """Show menu: like artist, artist albumes, artist playlists"""
-        if self._to_boolean(like):
+        if like:
             yield {
                 self.LABEL: u'❤ Like',
                 self.TARGET: {self.MODE: self.like_artist.__name__, 'artist_id': artist_id}
@@ -265,23 +896,37 @@ class DeezerBackend(Backend):
             self.TARGET: {self.MODE: self.artist_playlists.__name__, 'artist_id': artist_id, 'like': True}
         }
 
-    def artist_albums(self, artist_id, page=0, like=None):
-        url = 'http://api.deezer.com/artist/%s/albums?limit=20&index=%i'
-        data = self.load_json(url % (artist_id, int(page) * 20))
-        artist_data = self._load_json("http://api.deezer.com/artist/" + artist_id)
-        for album in data['data']:
-            yield self._extract_album(album, artist_data, like)
-        for next_page in self._next_page(page, data['total'], 20, {'artist_id': artist_id, 'like': like}):
-            yield next_page
+    def artist_albums(self, artist_id, page=0, like=None, all_items=None):
+        all_items = self._all_items(all_items)
+        url = 'http://api.deezer.com/artist/' + artist_id + '/albums?limit=%i&index=%i'
+        data, artist_data = self._load_json_many([
+            self._page_url(url, page),
+            'http://api.deezer.com/artist/' + artist_id
+        ])
+        self._hint_page_items(page, data['total'], all_items)
+        items = (self._extract_album(album, artist_data, like)
+                 for page_data in self._pages(data, url, page, data['total'], all_items)
+                 for album in page_data['data'])
+        for item in self._bulk_likes('albums', like, items):
+            yield item
+        if not all_items:
+            for next_page in self._next_page(self.artist_albums.__name__, page, data['total'], {'artist_id': artist_id, 'like': like}):
+                yield next_page
 
-    def artist_playlists(self, artist_id, page=0, like=None):
-        url = 'http://api.deezer.com/artist/%s/playlists?limit=20&index=%i'
-        data = self.load_json(url % (artist_id, int(page) * 20))
+    def artist_playlists(self, artist_id, page=0, like=None, all_items=None):
+        all_items = self._all_items(all_items)
+        url = 'http://api.deezer.com/artist/' + artist_id + '/playlists?limit=%i&index=%i'
+        data = self._load_json(self._page_url(url, page))
         if 'data' in data:
-            for playlist in data['data']:
-                yield self._extract_playlist(playlist, like)
-            for next_page in self._next_page(page, data['total'], 20, {'artist_id': artist_id, 'like': like}):
-                yield next_page
+            self._hint_page_items(page, data['total'], all_items)
+            items = (self._extract_playlist(playlist, like)
+                     for page_data in self._pages(data, url, page, data['total'], all_items)
+                     for playlist in page_data.get('data', []))
+            for item in self._bulk_likes('playlists', like, items):
+                yield item
+            if not all_items:
+                for next_page in self._next_page(self.artist_playlists.__name__, page, data['total'], {'artist_id': artist_id, 'like': like}):
+                    yield next_page
 
     def track(self, track_id):
         """"Load track data"""
@@ -289,70 +934,132 @@ class DeezerBackend(Backend):
         album = track['album']
         album['release_date'] = track['release_date']
         album = self._extract_album_data(album, track['artist'])
-        yield self._extract_track(track, track['track_position'], album, track['artist'])
+        yield self._extract_track(track, track['track_position'], album)
+
+    def play(self, track_id, next_track_id=None):
+        """Resolve the stream url of a track when kodi starts playing it"""
+        url = self.get_stream_url(track_id)
+        if not self._proxy_port:
+            self._frontend.resolve(url)
+            return
+        from lib.proxy import proxy_url
+        self._frontend.resolve(proxy_url(self._proxy_port, url))
+        if next_track_id:
+            try:
+                self._transport.get(proxy_url(self._proxy_port, self.get_stream_url(next_track_id), 'prefill'), timeout=2)
+            except Exception as error:
+                self.log('prefill of track %s failed: %s' % (next_track_id, error))
+
+    def _next_track_id(self, tracks, index):
+        """id of the track queued after tracks[index], only needed by the streaming proxy"""
+        if self._proxy_port and index + 1 < len(tracks):
+            return tracks[index + 1]['id']
+        return None
 
     def get_stream_url(self, track_id):
         if self._stream_url:
             return self._stream_url.format(track_id=track_id)
-        return self.load(self.API_STREAMING_URL, {
+        cache = self._stream_url_cache
+        if cache:
+            url = cache.get(str(track_id))
+            self.log('stream url cache %s for track %s (%i hits, %i misses)' % (
+                'hit' if url else 'miss', track_id, cache.hits, cache.misses))
+            if url:
+                return url
+        url = self.load(self.API_STREAMING_URL, {
             'access_token': self._access_token,
             'track_id': track_id,
             'device': 'panasonic'
         })
+        if cache and self.STREAM_URL.match(url or ''):
+            cache.set(str(track_id), url.strip(), self._stream_url_ttl)
+        return url
 
-    def _extract_track(self, track_data, index, album, artist):
-        result = {
-            self.TRACK_TITLE: track_data['title'],
-            self.ARTIST: artist['name'],
-            self.DURATION: int(track_data['duration']),
-            self.URL: self.get_stream_url(track_data['id'])
-        }
-        result.update(album)
-        if index != -1:
-            result[self.LABEL] = '%i. %s' % (index, track_data['title'])
-            result[self.TRACK_NUM] = index
-        else:
-            result[self.LABEL] = '%s (%s)' % (track_data['title'], artist['name'])
-        return result
+    def _extract_track(self, track_data, index, album, next_track_id=None):
+        return Track(track_data['id'], track_data['title'], int(track_data['duration']), album,
+                     None if index == -1 else index, next_track_id)
+
+    def _send_like(self, kind, item_id, like):
+        """like or unlike one item of the kind ('artists', 'albums' or 'playlists'), True on success"""
+        try:
+            response = self._api_get(
+                self._get_me_url() + '/' + kind,
+                {kind[:-1] + '_id': item_id, 'access_token': self._access_token,
+                 'request_method': 'POST' if like else 'DELETE'},
+                idempotent=False
+            )
+        except Exception as error:
+            self.log('%s %s %s failed: %s' % ('like' if like else 'unlike', kind[:-1], item_id, error))
+            return False
+        self.log('%s %s %s: %i - %s' % ('liked' if like else 'unliked', kind[:-1], item_id,
+                                       response.status_code, response.content[:40]))
+        return self._succeeded(response)
+
+    def _set_likes(self, kind, ids, like):
+        """like or unlike the items concurrently and report the outcome once"""
+        if kind not in Library.KINDS:
+            raise ValueError('unknown kind of favourites: %s' % kind)
+        results = parallel_map(lambda item_id: self._send_like(kind, item_id, like), ids, self._workers)
+        done = [item_id for item_id, succeeded in zip(ids, results) if succeeded]
+        if done:
+            self._favourites_changed(kind, done, like)
+        message = '%i of %i %s %s' % (len(done), len(ids), kind, 'liked' if like else 'unliked')
+        self.log(message)
+        self._frontend.notify(message)
+
+    def _favourites_changed(self, kind, ids, like):
+        """drop the cached favourites pages of the kind and update the library"""
+        if self._response_cache:
+            prefix = self._get_me_url() + '/' + kind + '?'
+            self._response_cache.delete_where(lambda key: key.startswith(prefix))
+        if not self._library or self._library.synced(kind) is None:
+            return
+        if not like:
+            for item_id in ids:
+                self._library.remove(kind, item_id)
+            return
+        url = 'http://api.deezer.com/' + kind[:-1] + '/'
+        for data in self._load_json_many([url + item_id for item_id in ids]):
+            if 'id' in data:
+                data = dict(data)
+                data.pop('tracks', None)
+                self._library.add(kind, data)
+
+    def _bulk_likes(self, kind, like, items):
+        """the items and, when they are listed to be liked or unliked, an entry doing it for all of them"""
+        ids = []
+        for item in items:
+            target = item[self.TARGET]
+            if like is not None and kind[:-1] + '_id' in target:
+                ids.append(unicode(target[kind[:-1] + '_id']))
+            yield item
+        if len(ids) > 1:
+            yield Entry(
+                (u'❤ Like all %i' if like else u'💔 Unlike all %i') % len(ids),
+                {self.MODE: (self.like_all if like else self.unlike_all).__name__, 'kind': kind, 'ids': ','.join(ids)})
+
+    def like_all(self, kind, ids):
+        """Like the comma separated ids of the kind"""
+        self._set_likes(kind, ids.split(','), True)
+
+    def unlike_all(self, kind, ids):
+        """Unlike the comma separated ids of the kind"""
+        self._set_likes(kind, ids.split(','), False)
 
     def like_artist(self, artist_id):
-        response = requests.get(
-            self._get_me_url() + '/artists&request_method=POST' % self._user_id,
-            {'artist_id': artist_id, 'access_token': self._access_token}
-        )
-        self.log('liked artist %s: %i - %s' % (artist_id, response.status_code, response.content[:40]))
+        self._set_likes('artists', [artist_id], True)
 
     def like_album(self, album_id):
-        response = requests.get(
-            self._get_me_url() + '/albums&request_method=POST' % self._user_id,
-            {'album_id': album_id, 'access_token': self._access_token}
-        )
-        self.log('liked album %s: %i - %s' % (album_id, response.status_code, response.content[:40]))
+        self._set_likes('albums', [album_id], True)
 
     def like_playlist(self, playlist_id):
-        response = requests.get(
-            self._get_me_url() + '/playlists&request_method=POST' % self._user_id,
-            {'playlist_id': playlist_id, 'access_token': self._access_token}
-        )
-        self.log('liked playlist %s: %i - %s' % (playlist_id, response.status_code, response.content[:40]))
+        self._set_likes('playlists', [playlist_id], True)
 
     def unlike_artist(self, artist_id):
-        response = requests.get(
-            self._get_me_url() + '/artists&request_method=DELETE',
-            {'artist_id': artist_id, 'access_token': self._access_token}
-        )
-        self.log('unliked artist %s: %i - %s' % (artist_id, response.status_code, response.content[:40]))
+        self._set_likes('artists', [artist_id], False)
 
     def unlike_album(self, album_id):
-        response = requests.get(
-            self._get_me_url() + '/albums&request_method=DELETE',
-            {'album_id': album_id, 'access_token': self._access_token}
-        )
-        self.log('unliked album %s: %i - %s' % (album_id, response.status_code, response.content[:40]))
+        self._set_likes('albums', [album_id], False)
 
     def unlike_playlist(self, playlist_id):
-        response = requests.get(
-            self._get_me_url() + '/playlists&request_method=DELETE',
-            {'playlist_id': playlist_id, 'access_token': self._access_token}
-        )
-        self.log('unliked playlist %s: %i - %s' % (playlist_id, response.status_code, response.content[:40]))
+        self._set_likes('playlists', [playlist_id], False)
@@ -0,0 +1,80 @@
+"""File helpers safe for concurrent plugin processes"""
+
+import errno
+import itertools
+import json
+import os
+import time
+
+# unique suffix of temporary files written by this process
+_TEMP_IDS = itertools.count()
+
+def atomic_write(path, content):
+    """Write the bytes to a temporary file and rename it into place"""
+    temp_path = '%s.%i-%i.tmp' % (path, os.getpid(), next(_TEMP_IDS))
+    with open(temp_path, 'wb') as temp_file:
+        temp_file.write(content)
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # windows does not replace existing files on rename
+        remove(path)
+        os.rename(temp_path, path)
+
+def read_json(path, default=None):
+    """Parsed content of the json file, default if it is missing or corrupt"""
+    try:
+        with open(path, 'rb') as json_file:
+            return json.loads(json_file.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return default
+
+def write_json(path, data):
+    atomic_write(path, json.dumps(data).encode('utf-8'))
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+class FileLock(object):
+    """Lock shared by all processes, held as long as the lock file exists.
+
+    Lock files older than stale seconds were left behind by a killed process
+    and are broken. Entering raises IOError if the lock is not acquired
+    within timeout seconds."""
+
+    def __init__(self, path, timeout=5, stale=30):
+        self._path = path
+        self._timeout = timeout
+        self._stale = stale
+
+    def __enter__(self):
+        deadline = time.time() + self._timeout
+        while True:
+            try:
+                os.close(os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.stat(self._path).st_mtime > self._stale:
+                    remove(self._path)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise IOError('timeout waiting for lock ' + self._path)
+            time.sleep(0.01)
+
+    def __exit__(self, *args):
+        remove(self._path)
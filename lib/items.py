@@ -0,0 +1,161 @@
+"""Compact records of the directory items produced by backends
+
+Tracks of an album or a playlist share one AlbumRef instead of each holding
+a copy of the album fields. The records read like the dicts the backends
+used to yield, so code and tests looking items up by key keep working."""
+
+from weakref import WeakValueDictionary
+from lib.addon import Backend
+
+class Record(object):
+    """Read only dict view of the slots of a record"""
+
+    __slots__ = ()
+
+    def keys(self):
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return self._value(key)
+
+    def _value(self, key):
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self._value(key)) for key in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, Record)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+class AlbumRef(object):
+    """Album fields shown with every track of the album"""
+
+    __slots__ = ('name', 'artist', 'thumb', 'year', 'track_count', 'fanart', '__weakref__')
+
+    # one instance per distinct album as long as tracks refer to it
+    _interned = WeakValueDictionary()
+
+    def __init__(self, name, artist, thumb=None, year=None, track_count=None, fanart=None):
+        self.name = name
+        self.artist = artist
+        self.thumb = thumb
+        self.year = year
+        self.track_count = track_count
+        self.fanart = fanart
+
+    @classmethod
+    def get(cls, name, artist, thumb=None, year=None, track_count=None, fanart=None):
+        """the shared instance with these fields"""
+        key = (name, artist, thumb, year, track_count, fanart)
+        album = cls._interned.get(key)
+        if album is None:
+            album = cls(name, artist, thumb, year, track_count, fanart)
+            cls._interned[key] = album
+        return album
+
+class Entry(Record):
+    """Directory entry opening the target, fanart is only set if it differs from the thumb"""
+
+    __slots__ = ('label', 'target', 'thumb', 'fanart')
+
+    def __init__(self, label, target, thumb=None, fanart=None):
+        self.label = label
+        self.target = target
+        self.thumb = thumb
+        self.fanart = fanart
+
+    def keys(self):
+        keys = (Backend.LABEL, Backend.TARGET)
+        if self.thumb is not None:
+            keys += (Backend.THUMB,)
+        if self.fanart is not None:
+            keys += (Backend.FANART,)
+        return keys
+
+    def _value(self, key):
+        return getattr(self, key)
+
+class Track(Record):
+    """Playable track, number is None for tracks listed outside of their album"""
+
+    __slots__ = ('track_id', 'title', 'duration', 'album', 'number', 'next_track_id')
+
+    ALBUM_FIELDS = {
+        Backend.ALBUM_NAME: 'name',
+        Backend.ARTIST: 'artist',
+        Backend.THUMB: 'thumb',
+        Backend.YEAR: 'year',
+        Backend.ALBUM_TRACK_COUNT: 'track_count',
+        Backend.FANART: 'fanart'
+    }
+    KEYS = (Backend.LABEL, Backend.TRACK_TITLE, Backend.ARTIST, Backend.DURATION, Backend.TARGET,
+            Backend.ALBUM_NAME, Backend.THUMB, Backend.YEAR, Backend.ALBUM_TRACK_COUNT)
+
+    def __init__(self, track_id, title, duration, album, number=None, next_track_id=None):
+        self.track_id = track_id
+        self.title = title
+        self.duration = duration
+        self.album = album
+        self.number = number
+        self.next_track_id = next_track_id
+
+    @property
+    def label(self):
+        if self.number is None:
+            return '%s (%s)' % (self.title, self.album.artist)
+        return '%i. %s' % (self.number, self.title)
+
+    @property
+    def target(self):
+        target = {Backend.MODE: 'play', 'track_id': self.track_id}
+        if self.next_track_id:
+            target['next_track_id'] = self.next_track_id
+        return target
+
+    def keys(self):
+        keys = self.KEYS
+        if self.number is not None:
+            keys += (Backend.TRACK_NUM,)
+        if self.album.fanart is not None:
+            keys += (Backend.FANART,)
+        return keys
+
+    def _value(self, key):
+        if key in self.ALBUM_FIELDS:
+            return getattr(self.album, self.ALBUM_FIELDS[key])
+        if key == Backend.TRACK_NUM:
+            return self.number
+        return getattr(self, key)
+
+def from_dict(item):
+    """record of an item a backend yields as plain dict"""
+    if Backend.TRACK_TITLE not in item:
+        return Entry(item[Backend.LABEL], item[Backend.TARGET], item.get(Backend.THUMB), item.get(Backend.FANART))
+    album = AlbumRef.get(item.get(Backend.ALBUM_NAME), item.get(Backend.ARTIST), item.get(Backend.THUMB),
+                         item.get(Backend.YEAR), item.get(Backend.ALBUM_TRACK_COUNT), item.get(Backend.FANART))
+    target = item[Backend.TARGET]
+    return Track(target.get('track_id'), item[Backend.TRACK_TITLE], item.get(Backend.DURATION), album,
+                 item.get(Backend.TRACK_NUM), target.get('next_track_id'))
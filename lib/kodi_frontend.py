@@ -1,17 +1,22 @@
 """Kodi specific classes"""
 
+import os
 import sys
-import urllib
 import xbmc
 import xbmcgui
 import xbmcplugin
 import xbmcaddon
 from lib.addon import Frontend
-from lib.addon import Backend
+from lib.artwork import ArtworkCache
+from lib.items import Track, from_dict
+from lib.routes import query
 
 class KodiFrontend(Frontend):
     """Kodi frontend"""
 
+    # directory items handed to kodi at once
+    CHUNK_SIZE = 50
+
     def __init__(self):
         Frontend.__init__(self)
         # 'plugin://plugin.audio.xxx/'
@@ -22,15 +27,32 @@ class KodiFrontend(Frontend):
         except IndexError:
             self._addon_name = ''
         self._addon_handle = int(sys.argv[1])
+        self._addon = None
+        self._settings = {}
+        self._artwork = None
         xbmcplugin.setPluginCategory(self._addon_handle, "Audio")
 
+    def _get_addon(self):
+        if self._addon is None:
+            self._addon = xbmcaddon.Addon(self._addon_name)
+        return self._addon
+
     def log(self, message):
         if self._debug:
             xbmc.log(str(message), xbmc.LOGNOTICE)
 
     def get_setting(self, name):
-        addon = xbmcaddon.Addon(self._addon_name)
-        return addon.getSetting(name)
+        """settings are read once per invocation"""
+        if name not in self._settings:
+            self._settings[name] = self._get_addon().getSetting(name)
+        return self._settings[name]
+
+    def set_setting(self, name, value):
+        self._get_addon().setSetting(name, value)
+        self._settings[name] = value
+
+    def get_profile_dir(self):
+        return xbmc.translatePath(self._get_addon().getAddonInfo('profile')).decode('utf-8')
 
     @staticmethod
     def _to_unicode(text):
@@ -45,47 +67,97 @@ class KodiFrontend(Frontend):
         result = dialog.input(self._to_unicode(message), self._to_unicode(''), type=xbmcgui.INPUT_ALPHANUM)
         return self._to_unicode(result).strip()
 
-    def render(self, items):
+    def render(self, items, hints=None):
+        """hand the items to kodi in chunks as the backend produces them"""
+        hints = hints or {}
+        self._artwork = self._artwork_cache()
         xbmcplugin.addSortMethod(self._addon_handle, xbmcplugin.SORT_METHOD_NONE)
+        if hints.get('content'):
+            xbmcplugin.setContent(self._addon_handle, hints['content'])
         entries = []
+        succeeded = False
         try:
             for item in items:
                 entries.append(self._render_item(item))
+                if len(entries) == self.CHUNK_SIZE:
+                    self._submit(entries)
+                    entries = []
+            succeeded = True
         finally:
-            xbmcplugin.addDirectoryItems(self._addon_handle, entries, len(entries))
-            xbmcplugin.endOfDirectory(self._addon_handle)
+            self._submit(entries)
+            with self.tracer.span('submit'):
+                xbmcplugin.endOfDirectory(
+                    self._addon_handle,
+                    updateListing=hints.get('update_listing', False),
+                    cacheToDisc=succeeded and hints.get('cache', False))
+            if self._artwork:
+                with self.tracer.span('artwork') as span:
+                    self._artwork.finish()
+                    span['downloaded'] = self._artwork.downloaded
+
+    def _artwork_cache(self):
+        """cache of the images shown in the listing, None if it is switched off"""
+        if self.get_setting('artwork_cache') == 'false':
+            return None
+        profile_dir = self.get_profile_dir()
+        if not profile_dir:
+            return None
+        try:
+            size, workers = int(self.get_setting('artwork_cache_size')), int(self.get_setting('http_workers'))
+        except ValueError:
+            size, workers = 2000, 4
+        return ArtworkCache(os.path.join(profile_dir, 'artwork'), size, workers, log=self.log)
+
+    def _art(self, url):
+        if url is None or self._artwork is None:
+            return url
+        return self._artwork.path(url)
+
+    def _submit(self, entries):
+        if entries:
+            with self.tracer.span('submit', items=len(entries)):
+                xbmcplugin.addDirectoryItems(self._addon_handle, entries, self._total_items or len(entries))
+
+    def notify(self, message):
+        xbmcgui.Dialog().notification(self._get_addon().getAddonInfo('name'), message)
+
+    def resolve(self, url):
+        xbmcplugin.setResolvedUrl(self._addon_handle, True, xbmcgui.ListItem(path=url))
+
+    def run_background(self, params):
+        xbmc.executebuiltin('RunPlugin(%s)' % self.build_url(params))
 
     def _render_item(self, item):
         """render a single item"""
+        if isinstance(item, dict):
+            item = from_dict(item)
         list_item = xbmcgui.ListItem()
-        if Backend.THUMB in item:
-            thumb = item[Backend.THUMB]
-            list_item.setArt({'thumb': thumb, 'icon': thumb, 'fanart': thumb})
-        if Backend.URL in item:
-            list_item.setLabel(item[Backend.TRACK_TITLE])
-            list_item.setLabel2('%s - %s (%s)' % (
-                item[Backend.ARTIST],
-                item[Backend.ALBUM_NAME],
-                item[Backend.YEAR]))
+        images = item.album if isinstance(item, Track) else item
+        thumb = self._art(images.thumb)
+        if thumb is not None:
+            list_item.setArt({'thumb': thumb, 'icon': thumb, 'fanart': self._art(images.fanart) or thumb})
+        if isinstance(item, Track):
+            album = item.album
+            list_item.setLabel(item.title)
+            list_item.setLabel2('%s - %s (%s)' % (album.artist, album.name, album.year))
             list_item.setProperty('IsPlayable', 'true')
             list_item.setProperty('mimetype', 'audio/mpeg')
             music_info = {
-                'title': item[Backend.TRACK_TITLE],
-                'artist': item[Backend.ARTIST],
-                'album': item[Backend.ALBUM_NAME],
-                'duration': item[Backend.DURATION]
+                'title': item.title,
+                'artist': album.artist,
+                'album': album.name,
+                'duration': item.duration,
+                'year': album.year
             }
-            if Backend.YEAR in item:
-                music_info['year'] = item[Backend.YEAR]
-            if Backend.TRACK_NUM in item:
-                music_info['tracknumber'] = item[Backend.TRACK_NUM]
+            if item.number is not None:
+                music_info['tracknumber'] = item.number
             list_item.setInfo('music', music_info)
-            return (item[Backend.URL], list_item, False)
+            return (self.build_url(item.target), list_item, False)
         else:
-            list_item.setLabel(item[Backend.LABEL])
-            url = self.build_url(item[Backend.TARGET])
+            list_item.setLabel(item.label)
+            url = self.build_url(item.target)
             self.log(('directory-entry ', url))
             return (url, list_item, True)
 
     def build_url(self, params):
-        return self._addon_url + '?' + urllib.urlencode(params)
+        return self._addon_url + '?' + query(params)
@@ -0,0 +1,128 @@
+"""Local index of the favourites of the user"""
+
+import json
+import time
+from lib.database import Database
+
+class Library(Database):
+    """Favourite artists, albums and playlists of the user in a sqlite database.
+
+    Deezer lists favourites newest first. A sync reads pages until it reaches
+    an item that is already indexed and stops there when the number of
+    favourites adds up. If it does not, favourites were removed elsewhere and
+    the kind is read completely again."""
+
+    KINDS = ('artists', 'albums', 'playlists')
+    ORDERS = {
+        'added': 'added DESC',
+        'name': 'name COLLATE NOCASE, added DESC',
+        'year': 'year IS NULL, year DESC, name COLLATE NOCASE'
+    }
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS favourites (
+            kind TEXT NOT NULL,
+            id TEXT NOT NULL,
+            name TEXT,
+            year TEXT,
+            added REAL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, id));
+        CREATE TABLE IF NOT EXISTS syncs (
+            kind TEXT PRIMARY KEY,
+            synced REAL,
+            checksum TEXT);
+    '''
+
+    def synced(self, kind):
+        """time of the last sync of the kind or None if it was never synced"""
+        row = self.connection.execute('SELECT synced FROM syncs WHERE kind = ?', (kind,)).fetchone()
+        return row[0] if row else None
+
+    def touch(self, kind):
+        """mark the kind as synced without syncing, keeps other processes from syncing it too"""
+        with self.connection:
+            self.connection.execute('UPDATE syncs SET synced = ? WHERE kind = ?', (time.time(), kind))
+
+    def count(self, kind):
+        return self.connection.execute('SELECT COUNT(*) FROM favourites WHERE kind = ?', (kind,)).fetchone()[0]
+
+    def items(self, kind, order='added', offset=0, limit=None):
+        """api data of the favourites of the kind in the order ('added', 'name' or 'year')"""
+        rows = self.connection.execute(
+            'SELECT data FROM favourites WHERE kind = ? ORDER BY %s LIMIT ? OFFSET ?'
+            % self.ORDERS.get(order, self.ORDERS['added']),
+            (kind, -1 if limit is None else limit, offset))
+        return [json.loads(data) for data, in rows]
+
+    @staticmethod
+    def _row(kind, data, added):
+        year = data.get('release_date', '')[:4] or None
+        name = data.get('name') if kind == 'artists' else data.get('title')
+        return (kind, str(data['id']), name, year, data.get('time_add', added), json.dumps(data))
+
+    def add(self, kind, data):
+        """index a favourite liked through the addon"""
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO favourites VALUES (?, ?, ?, ?, ?, ?)',
+                                    self._row(kind, data, time.time()))
+
+    def remove(self, kind, item_id):
+        with self.connection:
+            self.connection.execute('DELETE FROM favourites WHERE kind = ? AND id = ?', (kind, str(item_id)))
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM favourites')
+            self.connection.execute('DELETE FROM syncs')
+
+    def sync(self, kind, load_pages, size):
+        """bring the kind up to date, load_pages(indexes) returns the api pages at the indexes.
+
+        Returns the number of requests made."""
+        first = self._listing(load_pages([0])[0])
+        total = int(first.get('total', 0))
+        state = self.connection.execute('SELECT checksum FROM syncs WHERE kind = ?', (kind,)).fetchone()
+        checksum = first.get('checksum')
+        if state and checksum and state[0] == checksum:
+            self._synced(kind, checksum, [])
+            return 1
+        known = set(id for id, in self.connection.execute('SELECT id FROM favourites WHERE kind = ?', (kind,)))
+        new = []
+        page, index, requests = first, 0, 1
+        while True:
+            data = page.get('data', [])
+            fresh = [item for item in data if str(item['id']) not in known]
+            new.extend(fresh)
+            index += size
+            if len(fresh) < len(data) or not data or index >= total:
+                break
+            page = self._listing(load_pages([index])[0])
+            requests += 1
+        if len(known) + len(new) == total:
+            self._synced(kind, checksum, new)
+            return requests
+        # favourites were removed elsewhere, read them all
+        indexes = range(size, total, size)
+        items = list(first.get('data', []))
+        for page in load_pages(indexes):
+            items.extend(self._listing(page)['data'])
+        self._synced(kind, checksum, items, replace=True)
+        return 1 + len(indexes)
+
+    @staticmethod
+    def _listing(page):
+        """the page if the api listed favourites, error answers must not empty the library"""
+        if not isinstance(page, dict) or 'error' in page or 'data' not in page:
+            raise IOError('no favourites listed: %s' % (page.get('error') if isinstance(page, dict) else page,))
+        return page
+
+    def _synced(self, kind, checksum, items, replace=False):
+        now = time.time()
+        with self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM favourites WHERE kind = ?', (kind,))
+            # items without time of adding keep the order of the listing
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO favourites VALUES (?, ?, ?, ?, ?, ?)',
+                [self._row(kind, item, now - position) for position, item in enumerate(items)])
+            self.connection.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)', (kind, now, checksum))
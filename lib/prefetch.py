@@ -0,0 +1,113 @@
+"""Speculative loading of the menus the user is likely to open next"""
+
+import os
+import threading
+import time
+from lib.files import FileLock, atomic_write, read_json, write_json
+
+# the prefetcher running on the calling thread
+_running = threading.local()
+
+class PrefetchCancelled(Exception):
+    """The request budget is used up or the user navigated elsewhere"""
+
+class Prefetcher(object):
+    """Runs prefetch jobs on a background thread.
+
+    Every navigation writes a new generation token to the profile, a
+    prefetcher stops as soon as the token differs from the one of the
+    invocation that started it. The cache keys loaded are recorded, so later
+    cache hits on them can be counted as prefetch hits."""
+
+    GENERATION_FILE = 'prefetch_generation'
+    STATS_FILE = 'prefetch.json'
+    # prefetched keys remembered for the hit rate
+    MAX_KEYS = 200
+
+    def __init__(self, directory, generation, budget, log, finish=None):
+        self._directory = directory
+        self._generation = generation
+        self._budget = budget
+        self._log = log
+        # writes what the jobs produced once they are done, the invocation finished before
+        self._finish = finish
+        self.keys = []
+
+    @classmethod
+    def navigated(cls, directory):
+        """start a new generation, cancelling running prefetchers"""
+        generation = '%i-%f' % (os.getpid(), time.time())
+        atomic_write(os.path.join(directory, cls.GENERATION_FILE), generation.encode('utf-8'))
+        return generation
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self._directory, self.GENERATION_FILE), 'rb') as generation_file:
+                return generation_file.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+    def spend(self, requests):
+        """account for requests about to be made, raises PrefetchCancelled to stop"""
+        if requests > self._budget:
+            raise PrefetchCancelled('budget used up')
+        if self._current_generation() != self._generation:
+            raise PrefetchCancelled('navigated away')
+        self._budget -= requests
+
+    @staticmethod
+    def running():
+        """prefetcher of the calling thread, None outside of prefetch threads"""
+        return getattr(_running, 'prefetcher', None)
+
+    def start(self, jobs):
+        """run the jobs in order on a thread that outlives the rendering"""
+        thread = threading.Thread(target=self._run, args=(jobs,))
+        thread.start()
+        return thread
+
+    def _run(self, jobs):
+        _running.prefetcher = self
+        try:
+            for job in jobs:
+                try:
+                    job()
+                except PrefetchCancelled as reason:
+                    self._log('prefetch stopped: %s' % reason)
+                    break
+                except Exception as error:
+                    self._log('prefetch failed: %r' % error)
+        finally:
+            self._record()
+            if self._finish:
+                self._finish()
+            _running.prefetcher = None
+
+    def _record(self):
+        if not self.keys:
+            return
+        with FileLock(os.path.join(self._directory, 'prefetch.lock')):
+            path = os.path.join(self._directory, self.STATS_FILE)
+            stats = read_json(path, {})
+            keys = stats.get('keys', {})
+            now = time.time()
+            for key in self.keys:
+                keys[key] = now
+            stats['keys'] = dict(sorted(keys.items(), key=lambda item: item[1])[-self.MAX_KEYS:])
+            stats['prefetched'] = stats.get('prefetched', 0) + len(self.keys)
+            write_json(path, stats)
+        self._log('prefetched %i responses' % len(self.keys))
+
+    @classmethod
+    def hit(cls, directory, key):
+        """(hits, prefetched) if the key was prefetched and not used before, else None"""
+        path = os.path.join(directory, cls.STATS_FILE)
+        if not os.path.exists(path) or key not in read_json(path, {}).get('keys', {}):
+            return None
+        with FileLock(os.path.join(directory, 'prefetch.lock')):
+            stats = read_json(path, {})
+            if stats.get('keys', {}).pop(key, None) is None:
+                return None
+            stats['hits'] = stats.get('hits', 0) + 1
+            write_json(path, stats)
+        return stats['hits'], stats.get('prefetched', 0)
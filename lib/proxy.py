@@ -0,0 +1,258 @@
+"""Local streaming proxy buffering the audio ahead of the player"""
+
+import socket
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import quote, parse_qs
+
+CHUNK = 16 * 1024
+
+def proxy_url(port, url, path='stream'):
+    """url of the proxy serving (or prefilling) the provided stream url"""
+    return 'http://127.0.0.1:%i/%s?url=%s' % (port, path, quote(url, safe=''))
+
+class StreamBuffer(object):
+    """Bounded window over the bytes of one upstream url, filled ahead of the reader.
+
+    A background thread keeps up to read_ahead bytes beyond the reader
+    position in memory. Bytes behind the reader are kept as long as the
+    window stays below capacity, so short seeks backwards are answered from
+    memory as well."""
+
+    def __init__(self, opener, url, offset, capacity, read_ahead):
+        self.url = url
+        self.start = offset
+        self.data = bytearray()
+        self.total = None
+        self.content_type = 'audio/mpeg'
+        # set once the upstream answered, total stays None if it sent no length
+        self.headers_read = False
+        self.done = False
+        self.error = None
+        self._opener = opener
+        self._capacity = max(capacity, read_ahead + CHUNK)
+        self._read_ahead = read_ahead
+        self._position = offset
+        self._closed = False
+        self._condition = threading.Condition()
+        thread = threading.Thread(target=self._fill)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def _fill(self):
+        try:
+            response = self._opener(self.url, self.start)
+            try:
+                response.raise_for_status()
+                with self._condition:
+                    self._read_headers(response)
+                    self.headers_read = True
+                    self._condition.notify_all()
+                for chunk in response.iter_content(CHUNK):
+                    with self._condition:
+                        while not self._closed and self.end - self._position >= self._read_ahead:
+                            self._condition.wait(1)
+                        if self._closed:
+                            break
+                        self.data.extend(chunk)
+                        overflow = len(self.data) - self._capacity
+                        if overflow > 0:
+                            del self.data[:overflow]
+                            self.start += overflow
+                        self._condition.notify_all()
+            finally:
+                response.close()
+        except Exception as error:
+            self.error = error
+        finally:
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    def _read_headers(self, response):
+        content_range = response.headers.get('Content-Range')
+        if response.status_code == 206 and content_range and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            self.total = int(total) if total.isdigit() else None
+        else:
+            # the server ignored the range, the data starts at the beginning
+            self.start = 0
+            length = response.headers.get('Content-Length')
+            self.total = int(length) if length and length.isdigit() else None
+        self.content_type = response.headers.get('Content-Type', self.content_type)
+
+    def covers(self, offset):
+        """True if reading at offset does not need a new upstream request"""
+        return self.error is None and self.start <= offset <= self.end + self._read_ahead
+
+    def resume(self, read_ahead):
+        """change how far the buffer is filled ahead of the reader"""
+        with self._condition:
+            self._read_ahead = min(read_ahead, self._capacity - CHUNK)
+            self._condition.notify_all()
+
+    def wait_headers(self, timeout=30):
+        """wait until the upstream response started and return the total length, None if unknown"""
+        deadline = time.time() + timeout
+        with self._condition:
+            while not self.headers_read and not self.done and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+            return self.total
+
+    def read(self, offset, size, timeout=30):
+        """bytes at offset, waits for the filling thread, empty at the end of the stream"""
+        with self._condition:
+            self._position = offset
+            self._condition.notify_all()
+            deadline = time.time() + timeout
+            while offset >= self.end and not self.done:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise IOError('timeout reading %s' % self.url)
+                self._condition.wait(remaining)
+            if offset < self.start:
+                raise IOError('offset %i dropped from buffer of %s' % (offset, self.url))
+            if offset >= self.end:
+                if self.error:
+                    raise IOError(str(self.error))
+                return b''
+            index = offset - self.start
+            return bytes(self.data[index:index + size])
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+class StreamProxy(object):
+    """HTTP server on localhost answering (range) requests of stream urls from buffers.
+
+    GET /stream?url=... streams the url, GET /prefill?url=... buffers the
+    first bytes of the url ahead of time, e.g. for the next queued track."""
+
+    def __init__(self, transport, port=0, capacity=8 * 1024 * 1024, prefill=512 * 1024, keep=4):
+        self._transport = transport
+        self._capacity = capacity
+        self._read_ahead = capacity * 3 // 4
+        self._prefill = prefill
+        self._keep = keep
+        self._buffers = []
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.proxy = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for stream_buffer in self._buffers:
+                stream_buffer.close()
+            self._buffers = []
+
+    def _open(self, url, offset):
+        return self._transport.open(url, offset)
+
+    def buffer(self, url, offset, prefill=False):
+        """buffer able to serve url from offset, starts a new upstream request if needed"""
+        with self._lock:
+            for stream_buffer in self._buffers:
+                if stream_buffer.url == url and stream_buffer.covers(offset):
+                    self._buffers.remove(stream_buffer)
+                    self._buffers.append(stream_buffer)
+                    if not prefill:
+                        stream_buffer.resume(self._read_ahead)
+                    return stream_buffer
+            read_ahead = self._prefill if prefill else self._read_ahead
+            stream_buffer = StreamBuffer(self._open, url, offset, self._capacity, read_ahead)
+            self._buffers.append(stream_buffer)
+            while len(self._buffers) > self._keep:
+                self._buffers.pop(0).close()
+            return stream_buffer
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        url = parse_qs(query).get('url', [None])[0]
+        if not url or path not in ('/stream', '/prefill'):
+            self.send_error(404)
+            return
+        proxy = self.server.proxy
+        if path == '/prefill':
+            proxy.buffer(url, 0, prefill=True)
+            self.send_response(204)
+            self.end_headers()
+            return
+        first, last = self._range()
+        stream_buffer = proxy.buffer(url, first)
+        total = stream_buffer.wait_headers()
+        if stream_buffer.error is not None:
+            self.send_error(502)
+            return
+        if total is not None:
+            if first >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%i' % total)
+                self.end_headers()
+                return
+            last = total - 1 if last is None else min(last, total - 1)
+        if self.headers.get('Range'):
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %i-%s/%s' % (
+                first, '' if last is None else last, '*' if total is None else total))
+        else:
+            self.send_response(200)
+        if last is not None:
+            self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Content-Type', stream_buffer.content_type)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self._copy(stream_buffer, first, last)
+
+    def _copy(self, stream_buffer, position, last):
+        try:
+            while last is None or position <= last:
+                size = CHUNK if last is None else min(CHUNK, last - position + 1)
+                chunk = stream_buffer.read(position, size)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                position += len(chunk)
+        except (IOError, socket.error):
+            # player closed the connection, e.g. to seek
+            pass
+
+    def _range(self):
+        """(first, last) byte of the requested range, last is None for open ranges"""
+        value = self.headers.get('Range', '')
+        if not value.startswith('bytes='):
+            return 0, None
+        first, _, last = value[len('bytes='):].split(',')[0].partition('-')
+        try:
+            return int(first or 0), int(last) if last else None
+        except ValueError:
+            return 0, None
+
+    def log_message(self, format, *args):
+        pass
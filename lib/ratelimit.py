@@ -0,0 +1,69 @@
+"""Request rate limit shared by all plugin processes"""
+
+import os
+import time
+from lib.files import FileLock, read_json, write_json
+
+class RateLimiter(object):
+    """Token bucket kept in a state file of the profile.
+
+    Every request takes a token, tokens refill at rate per second up to
+    burst. A request finding the bucket empty reserves the next token and
+    sleeps until it is due, outside of the lock. Quota errors of the api
+    empty the bucket and block all processes for a backoff that doubles
+    while the errors continue."""
+
+    STATE_FILE = 'ratelimit.json'
+    # backoff after the first quota error and its upper bound in seconds
+    BACKOFF = 1.0
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, directory, rate=10.0, burst=50, sleep=time.sleep):
+        self._path = os.path.join(directory, self.STATE_FILE)
+        self._lock = os.path.join(directory, 'ratelimit.lock')
+        self._rate = float(rate)
+        self._burst = burst
+        self._sleep = sleep
+
+    def _state(self, now):
+        state = read_json(self._path, {})
+        tokens = state.get('tokens', self._burst)
+        elapsed = max(now - state.get('updated', now), 0)
+        state['tokens'] = min(self._burst, tokens + elapsed * self._rate)
+        state['updated'] = now
+        return state
+
+    def acquire(self):
+        """wait for a token, returns the seconds waited"""
+        try:
+            with FileLock(self._lock):
+                now = time.time()
+                state = self._state(now)
+                delay = max(state.get('blocked_until', 0) - now, 0)
+                if state['tokens'] < 1:
+                    delay = max(delay, (1 - state['tokens']) / self._rate)
+                state['tokens'] -= 1
+                write_json(self._path, state)
+        except IOError:
+            # a stuck lock must not stop all requests
+            return 0.0
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+    def quota_exceeded(self):
+        """block all processes after a quota error, returns the backoff in seconds"""
+        with FileLock(self._lock):
+            now = time.time()
+            state = self._state(now)
+            backoff = self.BACKOFF
+            if now - state.get('quota_error', 0) < self.MAX_BACKOFF * 2:
+                backoff = min(state.get('backoff', 0) * 2 or self.BACKOFF, self.MAX_BACKOFF)
+            state.update({
+                'tokens': min(state['tokens'], 0),
+                'blocked_until': max(state.get('blocked_until', 0), now + backoff),
+                'backoff': backoff,
+                'quota_error': now
+            })
+            write_json(self._path, state)
+        return backoff
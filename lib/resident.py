@@ -0,0 +1,195 @@
+"""Long-lived backend in the kodi service answering the plugin invocations over a local socket"""
+
+import json
+import socket
+import struct
+import threading
+from lib.addon import Addon, Frontend
+from lib.tracing import Tracer
+
+# messages are a 4 byte big endian length followed by that many bytes of utf-8 json
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 64 * 1024 * 1024
+DEFAULT_PORT = 52342
+# seconds the plugin waits for the service to accept and to answer
+CONNECT_TIMEOUT = 0.5
+RESPONSE_TIMEOUT = 120
+# frontend calls of the backend that are replayed on the frontend of the plugin
+REPLAYED = ('set_total_items', 'render', 'notify', 'resolve', 'run_background')
+
+def send_message(connection, message):
+    data = json.dumps(message).encode('utf-8')
+    connection.sendall(HEADER.pack(len(data)) + data)
+
+def _receive(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(min(size, 64 * 1024))
+        if not chunk:
+            raise IOError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def receive_message(connection):
+    size, = HEADER.unpack(_receive(connection, HEADER.size))
+    if size > MAX_MESSAGE:
+        raise IOError('message of %i bytes' % size)
+    return json.loads(_receive(connection, size).decode('utf-8'))
+
+class PluginOnly(Exception):
+    """The invocation needs the plugin process, e.g. to ask the user"""
+
+class ResidentFrontend(Frontend):
+    """Records the calls a backend makes to its frontend, the plugin replays them.
+
+    Settings are read from the addon on every call, the backend is recreated
+    when they change."""
+
+    def __init__(self, addon, log, profile_dir=None):
+        Frontend.__init__(self)
+        self._addon = addon
+        self._log = log
+        self._profile_dir = profile_dir
+        self.calls = []
+        self._thread = None
+
+    def begin(self):
+        """forget the previous invocation"""
+        self.calls = []
+        self._total_items = 0
+        self.tracer = Tracer()
+        self._thread = threading.current_thread()
+
+    def _record(self, name, args):
+        # background threads of the backend, e.g. prefetching, must not add to the answer
+        if threading.current_thread() is self._thread:
+            self.calls.append((name, args))
+
+    def log(self, message):
+        if self._debug:
+            self._log(str(message))
+
+    def get_setting(self, name):
+        return self._addon.getSetting(name)
+
+    def set_setting(self, name, value):
+        self._addon.setSetting(name, value)
+
+    def get_profile_dir(self):
+        return self._profile_dir
+
+    def get_keyboard_input(self, message):
+        raise PluginOnly('keyboard input')
+
+    def set_total_items(self, count):
+        if threading.current_thread() is self._thread:
+            Frontend.set_total_items(self, count)
+            self.calls.append(('set_total_items', [count]))
+
+    def render(self, items, hints=None):
+        self._record('render', [[dict(item) for item in items], hints])
+
+    def notify(self, message):
+        self._record('notify', [message])
+
+    def resolve(self, url):
+        self._record('resolve', [url])
+
+    def run_background(self, params):
+        self._record('run_background', [params])
+
+class ResidentService(object):
+    """Serves plugin invocations from one long-lived backend on a port of the loopback interface.
+
+    create_backend(frontend) is called on the first invocation and again
+    after settings_changed(). Invocations are handled one at a time."""
+
+    def __init__(self, create_backend, frontend, port=DEFAULT_PORT):
+        self._create_backend = create_backend
+        self._frontend = frontend
+        self._backend = None
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', port))
+        self._socket.listen(5)
+        # accept() returns regularly to notice stop()
+        self._socket.settimeout(0.5)
+        self.port = self._socket.getsockname()[1]
+        self._stopped = threading.Event()
+        self._thread = None
+        self.invocations = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self._socket.close()
+
+    def settings_changed(self):
+        self._backend = None
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            try:
+                connection.settimeout(RESPONSE_TIMEOUT)
+                send_message(connection, self.handle(receive_message(connection)))
+            except (IOError, ValueError) as error:
+                self._frontend.log('invocation failed: %s' % error)
+            finally:
+                connection.close()
+
+    def handle(self, request):
+        """response to the invocation {'query': ...}, the frontend calls or why the plugin has to do it"""
+        self.invocations += 1
+        if self._backend is not None:
+            self._backend.stop_prefetch()
+        frontend = self._frontend
+        frontend.begin()
+        if self._backend is None:
+            self._backend = self._create_backend(frontend)
+        try:
+            Addon(self._backend, frontend, debug=True).render(request['query'])
+        except PluginOnly as reason:
+            return {'fallback': str(reason)}
+        except Exception as error:
+            return {'error': repr(error)}
+        return {'calls': frontend.calls}
+
+def forward(frontend, query, port=DEFAULT_PORT):
+    """Replay the invocation of query answered by the service on frontend.
+
+    Returns False if the service is not running or can't answer it, the
+    plugin then runs the backend itself."""
+    try:
+        connection = socket.create_connection(('127.0.0.1', port), CONNECT_TIMEOUT)
+    except socket.error:
+        return False
+    try:
+        connection.settimeout(RESPONSE_TIMEOUT)
+        send_message(connection, {'query': query})
+        response = receive_message(connection)
+    except (IOError, ValueError) as error:
+        frontend.log('service failed: %s' % error)
+        return False
+    finally:
+        connection.close()
+    if 'fallback' in response:
+        frontend.log('service falls back for %s' % response['fallback'])
+        return False
+    if 'error' in response:
+        raise RuntimeError('service: ' + response['error'])
+    for name, args in response['calls']:
+        if name in REPLAYED:
+            getattr(frontend, name)(*args)
+    return True
@@ -0,0 +1,198 @@
+"""Latency budgets, hedged requests, retries and a circuit breaker for http calls"""
+
+import os
+import threading
+import time
+from Queue import Empty, Queue
+from urlparse import urlparse
+from lib.files import FileLock, read_json, write_json
+
+class CircuitOpen(IOError):
+    """The host failed repeatedly and is not asked again until its cool down passed"""
+
+class CircuitBreaker(object):
+    """Failure state per host kept in a file of the profile.
+
+    threshold consecutive failures open the circuit for cooldown seconds, all
+    processes then fail fast. Once it passed, one request probes the host:
+    success closes the circuit, failure opens it again for twice as long."""
+
+    STATE_FILE = 'circuit.json'
+
+    def __init__(self, directory, threshold=5, cooldown=30, max_cooldown=300):
+        self._path = os.path.join(directory, self.STATE_FILE)
+        self._lock = os.path.join(directory, 'circuit.lock')
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+
+    def check(self, host):
+        """raise CircuitOpen unless requests to the host may be sent"""
+        state = read_json(self._path, {}).get(host)
+        if not state or state.get('opened_until', 0) == 0:
+            return
+        now = time.time()
+        if now < state['opened_until']:
+            raise CircuitOpen('circuit of %s open for %.0f s' % (host, state['opened_until'] - now))
+        with FileLock(self._lock):
+            states = read_json(self._path, {})
+            state = states.get(host, {})
+            if now < state.get('opened_until', 0):
+                raise CircuitOpen('circuit of %s is probed' % host)
+            if state.get('opened_until'):
+                # this request probes the host, the others keep failing fast meanwhile
+                state['opened_until'] = now + state.get('cooldown', self._cooldown)
+                write_json(self._path, states)
+
+    def succeeded(self, host):
+        if read_json(self._path, {}).get(host):
+            with FileLock(self._lock):
+                states = read_json(self._path, {})
+                states.pop(host, None)
+                write_json(self._path, states)
+
+    def failed(self, host):
+        """count a failure, returns True if the circuit is open now"""
+        with FileLock(self._lock):
+            states = read_json(self._path, {})
+            state = states.setdefault(host, {'failures': 0})
+            state['failures'] += 1
+            opened = state['failures'] >= self._threshold
+            if opened:
+                cooldown = self._cooldown
+                if state.get('opened_until'):
+                    cooldown = min(state.get('cooldown', self._cooldown) * 2, self._max_cooldown)
+                state['cooldown'] = cooldown
+                state['opened_until'] = time.time() + cooldown
+            write_json(self._path, states)
+        return opened
+
+class Latencies(object):
+    """Recent response times per endpoint, shared through a file of the profile"""
+
+    STATE_FILE = 'latency.json'
+
+    def __init__(self, directory, samples=50):
+        self._path = os.path.join(directory, self.STATE_FILE)
+        self._lock = os.path.join(directory, 'latency.lock')
+        self._samples = samples
+        self._loaded = None
+        self._new = {}
+        self._mutex = threading.Lock()
+
+    def add(self, endpoint, seconds):
+        with self._mutex:
+            self._new.setdefault(endpoint, []).append(round(seconds, 4))
+
+    def percentile(self, endpoint, fraction, min_samples=10):
+        """response time not exceeded by the fraction of the recent responses, None if unknown"""
+        if self._loaded is None:
+            self._loaded = read_json(self._path, {})
+        with self._mutex:
+            samples = sorted(self._loaded.get(endpoint, []) + self._new.get(endpoint, []))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+    def save(self):
+        """merge the response times of this process into the shared file"""
+        with self._mutex:
+            new, self._new = self._new, {}
+        if not new:
+            return
+        with FileLock(self._lock):
+            latencies = read_json(self._path, {})
+            for endpoint, samples in new.items():
+                latencies[endpoint] = (latencies.get(endpoint, []) + samples)[-self._samples:]
+            write_json(self._path, latencies)
+
+class Resilience(object):
+    """Sends GET requests within a latency budget.
+
+    A request still running when the percentile of the recent response times
+    of its endpoint is exceeded is hedged: a duplicate is sent and the first
+    response wins. Failures and server errors are retried after a jittered
+    exponential backoff while the budget allows it, failures open the
+    circuit of the host."""
+
+    def __init__(self, breaker, latencies, retries=2, backoff=0.2, percentile=0.9, sleep=time.sleep):
+        self._breaker = breaker
+        self._latencies = latencies
+        self._retries = retries
+        self._backoff = backoff
+        self._percentile = percentile
+        self._sleep = sleep
+        self.hedged = 0
+
+    def get(self, send, url, endpoint, budget, idempotent=True):
+        """response of send(timeout) for the url, raises IOError once the retries or the budget are used up.
+
+        Requests changing something are neither hedged nor retried."""
+        host = urlparse(url).netloc
+        self._breaker.check(host)
+        deadline = time.time() + budget
+        retries = self._retries if idempotent else 0
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                if idempotent:
+                    response = self._hedged(send, endpoint, deadline - start)
+                else:
+                    response = send(deadline - start)
+                if response.status_code < 500:
+                    self._latencies.add(endpoint, time.time() - start)
+                    self._breaker.succeeded(host)
+                    return response
+                error = 'status %i' % response.status_code
+            except CircuitOpen:
+                raise
+            except Exception as exception:
+                error = exception
+            attempt += 1
+            # random is only needed once something failed
+            import random
+            delay = random.uniform(0, self._backoff * 2 ** attempt)
+            if attempt > retries or time.time() + delay >= deadline:
+                self._breaker.failed(host)
+                raise IOError('GET %s failed after %i attempts: %s' % (url, attempt, error))
+            self._sleep(delay)
+
+    def _hedged(self, send, endpoint, remaining):
+        threshold = self._latencies.percentile(endpoint, self._percentile)
+        if threshold is None or threshold >= remaining:
+            return send(remaining)
+        results = Queue()
+
+        def run():
+            try:
+                results.put((True, send(remaining)))
+            except Exception as exception:
+                results.put((False, exception))
+
+        deadline = time.time() + remaining
+        self._start(run)
+        try:
+            succeeded, value = results.get(timeout=threshold)
+        except Empty:
+            self.hedged += 1
+            self._start(run)
+        else:
+            if succeeded:
+                return value
+            raise value
+        for _ in range(2):
+            try:
+                succeeded, value = results.get(timeout=max(deadline - time.time(), 0.001))
+            except Empty:
+                raise IOError('no response within %.1f s' % remaining)
+            if succeeded:
+                return value
+        raise value
+
+    @staticmethod
+    def _start(target):
+        # a thread losing the race is left to finish on its own
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
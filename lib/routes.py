@@ -0,0 +1,70 @@
+"""Modes a backend serves and the types of their arguments"""
+
+import urllib
+
+class UnknownMode(ValueError):
+    """The url asks for a mode that is not in the route table of the backend"""
+
+def _boolean(value):
+    return value if isinstance(value, bool) else value in ('True', 'true', '1')
+
+# converters from the strings of a query, values already of the type pass unchanged
+CONVERTERS = {
+    int: int,
+    bool: _boolean,
+    str: lambda value: value if isinstance(value, basestring) else str(value)
+}
+
+def _query_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def query(params):
+    """query string of the params, None values are left out"""
+    return urllib.urlencode([(key, _query_value(value)) for key, value in params.items() if value is not None])
+
+class Route(object):
+    """A mode with the converters of its arguments"""
+
+    __slots__ = ('mode', '_converters')
+
+    def __init__(self, mode, params):
+        self.mode = mode
+        self._converters = dict((name, CONVERTERS[kind]) for name, kind in params.items())
+
+    def convert(self, args):
+        """(arguments of the mode method, names of the args the route does not take)"""
+        converted = {}
+        ignored = []
+        for name, value in args.items():
+            converter = self._converters.get(name)
+            if converter is None:
+                ignored.append(name)
+            elif value is not None:
+                converted[name] = converter(value)
+        return converted, ignored
+
+    def target(self, mode_key, **args):
+        """target dict of the mode with the args, None values are left out"""
+        for name in args:
+            if name not in self._converters:
+                raise TypeError('%s takes no argument %s' % (self.mode, name))
+        target = dict((name, value) for name, value in args.items() if value is not None)
+        target[mode_key] = self.mode
+        return target
+
+class Routes(object):
+    """Route table compiled from a {mode: {argument: type}} declaration"""
+
+    def __init__(self, table):
+        self._routes = dict((mode, Route(mode, params)) for mode, params in table.items())
+
+    def __contains__(self, mode):
+        return mode in self._routes
+
+    def get(self, mode):
+        try:
+            return self._routes[mode]
+        except KeyError:
+            raise UnknownMode('unknown mode %r' % (mode,))
@@ -0,0 +1,144 @@
+"""Full text index of the artists, albums, playlists and tracks seen in api responses"""
+
+import difflib
+import json
+import re
+import threading
+import time
+from lib.database import Database
+
+class SearchIndex(Database):
+    """Items of api responses in a sqlite fts4 table, matched by word prefixes.
+
+    Words of the query without any match are replaced by the closest indexed
+    words, so small typos still find the item. The least recently seen items
+    are dropped beyond max_entries."""
+
+    KINDS = ('artist', 'album', 'playlist', 'track')
+    # fields the backend needs to list an item of the kind
+    REQUIRED = {
+        'artist': ('name', 'picture_big'),
+        'album': ('title', 'cover_big'),
+        'playlist': ('title', 'picture_big'),
+        'track': ('title', 'duration', 'album', 'artist')
+    }
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS items (
+            docid INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            id TEXT NOT NULL,
+            seen REAL,
+            data TEXT NOT NULL,
+            UNIQUE (kind, id));
+        CREATE VIRTUAL TABLE IF NOT EXISTS words USING fts4(name, artist, tokenize=unicode61);
+        CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY);
+    '''
+    WORD = re.compile(r'\w+', re.UNICODE)
+
+    def __init__(self, path, max_entries=5000):
+        Database.__init__(self, path)
+        self._max_entries = max_entries
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def collect(self, data, album=None):
+        """remember the items of the response, they are written by flush()"""
+        if isinstance(data, list):
+            for value in data:
+                self.collect(value, album)
+            return
+        if not isinstance(data, dict):
+            return
+        kind = data.get('type')
+        if kind == 'track' and 'album' not in data and album:
+            # tracks listed in an album response
+            data = dict(data, album=dict(album, tracks=None), artist=album.get('artist'))
+        if kind in self.KINDS and 'id' in data and all(data.get(field) for field in self.REQUIRED[kind]):
+            with self._pending_lock:
+                self._pending[(kind, unicode(data['id']))] = data
+        for value in data.values():
+            if isinstance(value, (dict, list)):
+                self.collect(value, data if kind == 'album' else album)
+
+    @staticmethod
+    def _words(kind, data):
+        name = data.get('name') if kind == 'artist' else data.get('title')
+        artist = (data.get('artist') or {}).get('name', '') if kind in ('album', 'track') else ''
+        return name, artist
+
+    def flush(self):
+        """write the collected items, returns how many were written"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        now = time.time()
+        with self.connection as connection:
+            for (kind, item_id), data in pending.items():
+                data = dict((key, value) for key, value in data.items() if key != 'tracks')
+                row = connection.execute('SELECT docid FROM items WHERE kind = ? AND id = ?', (kind, item_id)).fetchone()
+                if row:
+                    connection.execute('UPDATE items SET seen = ?, data = ? WHERE docid = ?',
+                                       (now, json.dumps(data), row[0]))
+                    continue
+                docid = connection.execute('INSERT INTO items (kind, id, seen, data) VALUES (?, ?, ?, ?)',
+                                           (kind, item_id, now, json.dumps(data))).lastrowid
+                name, artist = self._words(kind, data)
+                connection.execute('INSERT INTO words (docid, name, artist) VALUES (?, ?, ?)', (docid, name, artist))
+                connection.executemany('INSERT OR IGNORE INTO terms VALUES (?)',
+                                       [(word,) for word in self.WORD.findall((u'%s %s' % (name, artist)).lower())])
+            self._evict(connection)
+        return len(pending)
+
+    def _evict(self, connection):
+        excess = connection.execute('SELECT COUNT(*) FROM items').fetchone()[0] - self._max_entries
+        if excess > 0:
+            docids = [(docid,) for docid, in connection.execute(
+                'SELECT docid FROM items ORDER BY seen LIMIT ?', (excess,))]
+            words = set()
+            for docid, in docids:
+                for name, artist in connection.execute('SELECT name, artist FROM words WHERE docid = ?', (docid,)):
+                    words.update(self.WORD.findall((u'%s %s' % (name, artist)).lower()))
+            connection.executemany('DELETE FROM items WHERE docid = ?', docids)
+            connection.executemany('DELETE FROM words WHERE docid = ?', docids)
+            # terms only offer corrections for words that are still indexed
+            connection.executemany('DELETE FROM terms WHERE term = ?', [
+                (word,) for word in words
+                if not connection.execute('SELECT 1 FROM words WHERE words MATCH ? LIMIT 1', ('"%s"' % word,)).fetchone()])
+
+    def clear(self):
+        with self._pending_lock:
+            self._pending = {}
+        with self.connection as connection:
+            for table in ('items', 'words', 'terms'):
+                connection.execute('DELETE FROM %s' % table)
+
+    def _docids(self, word):
+        """documents with a word starting with word or, failing that, with the closest words"""
+        match = 'SELECT docid FROM words WHERE words MATCH ?'
+        docids = set(docid for docid, in self.connection.execute(match, (word + '*',)))
+        if docids or len(word) < 3:
+            return docids
+        candidates = [term for term, in self.connection.execute(
+            'SELECT term FROM terms WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?',
+            (word[0], word[0] + u'\uffff', len(word) - 2, len(word) + 2))]
+        for term in difflib.get_close_matches(word, candidates, n=3, cutoff=0.75):
+            docids.update(docid for docid, in self.connection.execute(match, (term,)))
+        return docids
+
+    def search(self, query, limit=10):
+        """[(kind, data)] of the items matching all words of the query, most recently seen first"""
+        if isinstance(query, str):
+            query = query.decode('utf-8')
+        docids = None
+        for word in self.WORD.findall(query.lower()):
+            found = self._docids(word)
+            docids = found if docids is None else docids & found
+            if not docids:
+                return []
+        if not docids:
+            return []
+        rows = self.connection.execute(
+            'SELECT kind, data FROM items WHERE docid IN (%s) ORDER BY seen DESC LIMIT ?'
+            % ','.join(str(docid) for docid in docids), (limit,))
+        return [(kind, json.loads(data)) for kind, data in rows]
@@ -0,0 +1,46 @@
+"""Shuffled orders whose positions are computed one at a time"""
+
+import os
+import struct
+
+def new_seed():
+    return struct.unpack('>I', os.urandom(4))[0]
+
+class Permutation(object):
+    """Seeded bijection of range(size), permutation[position] is the index shown at position.
+
+    A balanced feistel network permutes the smallest range of an even number
+    of bits holding size, indexes beyond size are permuted again until they
+    fall into range(size) (cycle walking). Every position costs a few integer
+    operations, so a page of a long list is shuffled without the others."""
+
+    ROUNDS = 4
+
+    def __init__(self, size, seed):
+        self.size = size
+        self._half_bits = max(((size - 1).bit_length() + 1) // 2, 1)
+        self._mask = (1 << self._half_bits) - 1
+        self._keys = []
+        key = seed & 0xffffffff
+        for _ in range(self.ROUNDS):
+            key = int((key * 0x9e3779b1 + 0x7f4a7c15) & 0xffffffff)
+            self._keys.append(key)
+
+    def _round(self, value, key):
+        value = ((value ^ key) * 0x45d9f3b) & 0xffffffff
+        return (value ^ (value >> 16)) & self._mask
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        value = position
+        while True:
+            left, right = value >> self._half_bits, value & self._mask
+            for key in self._keys:
+                left, right = right, left ^ self._round(right, key)
+            value = (left << self._half_bits) | right
+            if value < self.size:
+                return value
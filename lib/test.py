@@ -3,9 +3,36 @@
 import unittest
 import difflib
 import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from lib import benchmark
 from lib.addon import Addon
 from lib.addon import Frontend
+from lib.artwork import ArtworkCache
+from lib.cache import DiskCache
 from lib.deezerbackend import DeezerBackend
+from lib.files import FileLock
+from lib.items import AlbumRef, Entry, Track, from_dict
+from lib.prefetch import PrefetchCancelled, Prefetcher
+from lib.search_index import SearchIndex
+from lib.proxy import StreamProxy, proxy_url
+from lib.ratelimit import RateLimiter
+from lib.resident import ResidentFrontend, ResidentService, forward
+from lib.resilience import CircuitBreaker, CircuitOpen, Latencies, Resilience
+from lib.routes import UnknownMode, query
+from lib.tracing import Tracer
+from lib.transport import Transport
+from lib.workers import parallel_map
 
 class MockFrontend(Frontend):
     '''mock frontend class'''
@@ -15,17 +42,38 @@ class MockFrontend(Frontend):
         self._items = []
         self._settings = {'stream_url': 'http://stream/{track_id}'}
         self._keyboard_input = 'test input'
+        self._resolved = None
+        self._profile_dir = None
+        self._background = []
+        self._notifications = []
 
     def get_setting(self, key):
         return self._settings.get(key, None)
 
+    def set_setting(self, key, value):
+        self._settings[key] = value
+
+    def get_profile_dir(self):
+        return self._profile_dir
+
     def get_keyboard_input(self, message):
         return self._keyboard_input
 
-    def render(self, items):
+    def render(self, items, hints=None):
+        items = list(items)
         if not items:
             raise Exception('no None type expected')
         self._items = items
+        self._hints = hints
+
+    def notify(self, message):
+        self._notifications.append(message)
+
+    def resolve(self, url):
+        self._resolved = url
+
+    def run_background(self, params):
+        self._background.append(params)
 
 class TestAddon(unittest.TestCase):
 
@@ -34,10 +82,15 @@ class TestAddon(unittest.TestCase):
         backend = DeezerBackend(self._frontend, self)
         self._addon = Addon(backend, self._frontend, debug=True)
         self._url_2_json = {'stream_url':''}
+        self._batches = []
 
-    def load_json(self, url):
+    def load_json(self, url, params={}):
         return self._url_2_json.pop(url)
 
+    def load_json_many(self, urls, params={}):
+        self._batches.append(urls)
+        return [self.load_json(url, params) for url in urls]
+
     def assertResult(self, aaa):
         #bbb = []
         #bbb.extend(self._frontend._items)
@@ -46,8 +99,8 @@ class TestAddon(unittest.TestCase):
             self.assertSequenceEqual(aaa, bbb)
         except Exception:
             diff = difflib.unified_diff(
-                json.dumps(bbb, sort_keys=True, indent=4).splitlines(1),
-                json.dumps(aaa, sort_keys=True, indent=4).splitlines(1)
+                json.dumps(bbb, sort_keys=True, indent=4, default=dict).splitlines(1),
+                json.dumps(aaa, sort_keys=True, indent=4, default=dict).splitlines(1)
             )
             raise Exception(''.join(diff))
 
@@ -55,9 +108,42 @@ class TestAddon(unittest.TestCase):
         self._addon.render('')
         self.assertResult([
             {'label': 'Search', 'target': {'mode': 'search'}},
+            {'label': 'Search everything', 'target': {'mode': 'search_all'}},
             {'label': 'Albums', 'target': {'mode': 'albums'}}
         ])
 
+    def test_search_all_ranks_sections(self):
+        url = 'http://api.deezer.com/search/%s?q=discovery&limit=5&index=0'
+        self._url_2_json[url % 'artist'] = {'data': [
+            {'id': 'artist-id', 'name': 'Discovery Singers', 'picture_big': 'picture'}], 'total': 1}
+        self._url_2_json[url % 'album'] = {'data': [
+            {'id': 'album-id', 'title': 'Discovery', 'cover_big': 'cover', 'artist': {'name': 'Daft Punk'}}], 'total': 12}
+        self._url_2_json[url % 'track'] = {'data': [], 'total': 0}
+        self._url_2_json[url % 'playlist'] = {'data': [
+            {'id': 'playlist-id', 'title': 'Discovering jazz', 'picture_big': 'picture'}], 'total': 3}
+        self._addon.render('?mode=search_all&query=discovery')
+        self.assertEqual([[url % kind for kind in ('artist', 'album', 'track', 'playlist')]], self._batches)
+        self.assertEqual([
+            'Albums (12)', 'Discovery - Daft Punk', 'Artists (1)', 'Discovery Singers',
+            'Playlists (3)', 'Discovering jazz'
+        ], [item['label'] for item in self._frontend._items])
+        self.assertEqual({'mode': 'search', 'query': 'discovery', 'kind': 'album'}, self._frontend._items[0]['target'])
+
+    def test_search_section_pages(self):
+        self._url_2_json['http://api.deezer.com/search/track?q=xxx&limit=20&index=20'] = {
+            'data': [{'id': 'track-id', 'title': 'track-title', 'duration': '60',
+                      'album': {'title': 'album-title', 'cover_big': 'cover'}, 'artist': {'name': 'artist-name'}}],
+            'total': '41'
+        }
+        self._addon.render('?mode=search&query=xxx&kind=track&page=1')
+        self.assertEqual('track-title (artist-name)', self._frontend._items[0]['label'])
+        self.assertEqual({'mode': 'search', 'query': 'xxx', 'kind': 'track', 'page': 2}, self._frontend._items[1]['target'])
+
+    def test_search_kind_is_checked(self):
+        for kind in ('album_data', 'track?q=x#'):
+            self.assertRaises(ValueError, self._addon.render, '?' + urllib.urlencode(
+                {'mode': 'search', 'query': 'xxx', 'kind': kind}))
+
     def test_top_albums(self):
         self._url_2_json['http://api.deezer.com/chart/0?limit=20&index=20'] = {
             "albums":
@@ -84,6 +170,8 @@ class TestAddon(unittest.TestCase):
         self.assertResult(
             [{'target': {'mode': 'album', 'album_id': 'album-id'}, 'thumb': 'album-cover', 'label': 'album-title - artist-name'},
              {'target': {'mode': 'albums', 'page': 2}, 'label': 'page 3'}])
+        self.assertEqual({'content': 'albums', 'cache': False, 'update_listing': True}, self._frontend._hints)
+        self.assertEqual(21, self._frontend._total_items)
 
     def test_album(self):
         self._url_2_json['http://api.deezer.com/album/302127'] = {
@@ -120,7 +208,7 @@ class TestAddon(unittest.TestCase):
                 'thumb': 'album-cover',
                 'track_count': '14',
                 'title': 'track-title',
-                'url': 'http://stream/track-id',
+                'target': {'mode': 'play', 'track_id': 'track-id'},
                 'artist': 'artist-name',
                 'year': '2001',
                 'duration': 320,
@@ -131,7 +219,7 @@ class TestAddon(unittest.TestCase):
                 'thumb': 'album-cover',
                 'track_count': '14',
                 'title': 'track-title2',
-                'url': 'http://stream/track-id2',
+                'target': {'mode': 'play', 'track_id': 'track-id2'},
                 'artist': 'artist-name',
                 'year': '2001',
                 'duration': 321,
@@ -192,13 +280,1109 @@ class TestAddon(unittest.TestCase):
             'label': '5. track-title',
             'artist': 'artist-name',
             'thumb': 'album-cover',
+            'track_count': None,
             'title': 'track-title',
-            'url': 'http://stream/track-id',
+            'target': {'mode': 'play', 'track_id': 'track-id'},
             'year': '2001',
             'duration': 42,
             'tracknumber': 5,
             'album': 'album-title'
         }])
 
+    def test_page_size_setting(self):
+        self._frontend._settings['page_size'] = '50'
+        self._url_2_json['http://api.deezer.com/search/artist?q=xxx&limit=50&index=50'] = {
+            'data': [{'id': 'artist-id', 'name': 'artist-name', 'picture_big': 'artist-picture'}],
+            'total': '101'
+        }
+        Addon(DeezerBackend(self._frontend, self), self._frontend).render('?mode=search&query=xxx&page=1')
+        self.assertResult([
+            {'target': {'mode': 'artist', 'artist_id': 'artist-id'}, 'thumb': 'artist-picture', 'label': 'artist-name'},
+            {'target': {'query': 'xxx', 'mode': 'search', 'page': 2}, 'label': 'page 3'}
+        ])
+
+    def test_unknown_modes_are_rejected(self):
+        for url in ('?mode=get_stream_url&track_id=1', '?mode=_load_json&url=x', '?mode=nothing'):
+            self.assertRaises(UnknownMode, self._addon.render, url)
+
+    def test_arguments_are_converted_once_and_pages_keep_them(self):
+        self._url_2_json['http://api.deezer.com/artist/artist-id/albums?limit=20&index=20'] = {
+            'data': [{'id': 'album-id', 'title': 'album-title', 'cover_big': 'album-cover'}],
+            'total': 41
+        }
+        self._url_2_json['http://api.deezer.com/artist/artist-id'] = {'id': 'artist-id', 'name': 'artist-name'}
+        self._addon.render('?mode=artist_albums&artist_id=artist-id&page=1&like=False&unused=1')
+        self.assertEqual({'mode': 'artist_albums', 'artist_id': 'artist-id', 'page': 2, 'like': False},
+                         self._frontend._items[-1]['target'])
+        url = Frontend().build_url({'mode': 'artist_albums', 'page': 2, 'like': False, 'sort': None})
+        self.assertEqual(['like=False', 'mode=artist_albums', 'page=2'], sorted(url[1:].split('&')))
+
+    def test_all_items_are_loaded_concurrently_in_order(self):
+        url = 'http://api.deezer.com/artist/artist-id/playlists?limit=20&index=%i'
+        for index in (0, 20, 40):
+            self._url_2_json[url % index] = {
+                'data': [{'id': str(index), 'title': 'playlist', 'picture_big': 'picture'}],
+                'total': 45
+            }
+        self._addon.render('?mode=artist_playlists&artist_id=artist-id&all_items=True')
+        self.assertEqual([[url % 20, url % 40]], self._batches)
+        self.assertEqual(['0', '20', '40'], [item['target']['playlist_id'] for item in self._frontend._items])
+
+    def _add_playlist(self, total):
+        url = 'http://api.deezer.com/playlist/playlist-id/tracks?limit=100&index=%i'
+        for index in range(0, total, 100):
+            self._url_2_json[url % index] = {'data': [{
+                'id': str(track),
+                'title': 'track-title',
+                'duration': '1',
+                'album': {'title': 'album-title'},
+                'artist': {'name': 'artist-name'}
+            } for track in range(index, min(index + 100, total))], 'total': total}
+        return url
+
+    def test_complete_playlist_in_order(self):
+        url = self._add_playlist(250)
+        self._addon.render('?mode=playlist&playlist_id=playlist-id&shuffle=False')
+        self.assertEqual([[url % 100, url % 200]], self._batches)
+        self.assertEqual([str(track) for track in range(250)],
+                         [item['target']['track_id'] for item in self._frontend._items])
+        self.assertEqual({'mode': 'play', 'track_id': '0'}, self._frontend._items[0]['target'])
+
+    def test_shuffled_playlist(self):
+        self._add_playlist(150)
+        self._addon.render('?mode=playlist&playlist_id=playlist-id')
+        track_ids = [item['target']['track_id'] for item in self._frontend._items[:-1]]
+        self.assertEqual(sorted(str(track) for track in range(150)), sorted(track_ids))
+        self.assertEqual(u'\U0001f500 Reshuffle', self._frontend._items[-1]['label'])
+
+    def test_shuffled_playlist_pages_keep_their_order(self):
+        self._frontend._profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._frontend._profile_dir)
+        self._frontend._settings['playlist_page_size'] = '100'
+        self._add_playlist(250)
+
+        def render(url):
+            Addon(DeezerBackend(self._frontend, self), self._frontend).render(url)
+            return self._frontend._items
+        first = render('?mode=playlist&playlist_id=playlist-id')
+        second = render('?' + query(first[-1]['target']))
+        third = render('?' + query(second[-1]['target']))
+        self.assertEqual(['page 2', 'page 3', u'\U0001f500 Reshuffle'], [first[-1]['label'], second[-1]['label'], third[-1]['label']])
+        pages = [first[:-2], second[:-2], third[:-1]]
+        self.assertEqual([100, 100, 50], [len(page) for page in pages])
+        track_ids = [item['target']['track_id'] for page in pages for item in page]
+        self.assertEqual(sorted(str(track) for track in range(250)), sorted(track_ids))
+        # the next visit lists the cached playlist in the same order, a reshuffle changes it
+        def tracks(items):
+            return [item['target']['track_id'] for item in items[:-2]]
+        self.assertEqual(tracks(first), tracks(render('?mode=playlist&playlist_id=playlist-id')))
+        reshuffled = tracks(render('?' + query(first[-2]['target'])))
+        self.assertNotEqual(tracks(first), reshuffled)
+        self.assertEqual(reshuffled, tracks(render('?mode=playlist&playlist_id=playlist-id')))
+
+    def test_artist_albums(self):
+        self._url_2_json['http://api.deezer.com/artist/artist-id/albums?limit=20&index=0'] = {
+            'data': [{'id': 'album-id', 'title': 'album-title', 'cover_big': 'album-cover'}],
+            'total': 1
+        }
+        self._url_2_json['http://api.deezer.com/artist/artist-id'] = {'id': 'artist-id', 'name': 'artist-name'}
+        self._addon.render('?mode=artist_albums&artist_id=artist-id')
+        self.assertEqual([[
+            'http://api.deezer.com/artist/artist-id/albums?limit=20&index=0',
+            'http://api.deezer.com/artist/artist-id'
+        ]], self._batches)
+        self.assertResult([
+            {'target': {'mode': 'album', 'album_id': 'album-id'}, 'thumb': 'album-cover', 'label': 'album-title - artist-name'}
+        ])
+
+    def test_play(self):
+        self._addon.render('?mode=play&track_id=track-id')
+        self.assertEqual('http://stream/track-id', self._frontend._resolved)
+        self.assertSequenceEqual([], self._frontend._items)
+
+    def test_play_resolves_from_streaming_api(self):
+        self._frontend._settings['stream_url'] = ''
+        self._frontend._settings['access_token'] = 'token'
+        self._frontend._settings['user_id'] = 'user-id'
+        addon = Addon(DeezerBackend(self._frontend, self), self._frontend)
+        loaded = []
+        addon._backend.load = lambda url, params={}: loaded.append((url, params)) or 'http://cdn/track-id.mp3'
+        addon.render('?mode=play&track_id=track-id')
+        self.assertEqual('http://cdn/track-id.mp3', self._frontend._resolved)
+        self.assertEqual([(DeezerBackend.API_STREAMING_URL, {
+            'access_token': 'token', 'track_id': 'track-id', 'device': 'panasonic'
+        })], loaded)
+
+    def test_play_caches_stream_url(self):
+        self._frontend._settings['stream_url'] = ''
+        self._frontend._profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._frontend._profile_dir)
+        loaded = []
+        for _ in range(2):
+            addon = Addon(DeezerBackend(self._frontend, self), self._frontend)
+            addon._backend.load = lambda url, params={}: loaded.append(url) or 'http://cdn/track-id.mp3'
+            addon.render('?mode=play&track_id=track-id')
+            self.assertEqual('http://cdn/track-id.mp3', self._frontend._resolved)
+        self.assertEqual(1, len(loaded))
+
+    def test_failed_stream_url_is_not_cached(self):
+        self._frontend._settings['stream_url'] = ''
+        self._frontend._profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._frontend._profile_dir)
+        responses = [MockResponse('{"error": {"code": 800}}'), MockResponse('Forbidden', 403),
+                     MockResponse('http://cdn/track-id.mp3')]
+        session = MockSession([])
+        session.get = lambda url, params=None, timeout=None: responses.pop(0)
+        backend = DeezerBackend(self._frontend, transport=Transport(session))
+        self.assertEqual('{"error": {"code": 800}}', backend.get_stream_url('track-id'))
+        self.assertRaises(IOError, backend.get_stream_url, 'track-id')
+        self.assertEqual('http://cdn/track-id.mp3', backend.get_stream_url('track-id'))
+        self.assertEqual('http://cdn/track-id.mp3', backend.get_stream_url('track-id'))
+        self.assertEqual([], responses)
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self._frontend = MockFrontend()
+        self._frontend._settings['access_token'] = 'token'
+        self._frontend._settings['user_id'] = 'user-id'
+        # favourites are served from the library otherwise
+        self._frontend._settings['library'] = 'false'
+        self._frontend._profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._frontend._profile_dir)
+        self._requests = []
+        self._delay = 0
+
+    def load_json(self, url, params={}):
+        self._requests.append((url, params))
+        return {'data': [], 'total': 0}
+
+    def load_json_many(self, urls, params={}):
+        return [self.load_json(url, params) for url in urls]
+
+    def test_responses_are_cached_without_access_token(self):
+        backend = DeezerBackend(self._frontend, self)
+        list(backend.my_albums())
+        list(DeezerBackend(self._frontend, self).my_albums())
+        self.assertEqual([
+            ('https://api.deezer.com/user/user-id/albums?&limit=20&index=0', {'access_token': 'token'})
+        ], self._requests)
+        self.assertEqual(
+            'https://api.deezer.com/user/user-id/albums?&limit=20&index=0#',
+            backend._cache_key(*self._requests[0]))
+
+    def test_user_lookup_and_errors_are_not_cached(self):
+        self._frontend._settings['user_id'] = ''
+        self.load_json = lambda url, params={}: self._requests.append(url) or {'id': 'me', 'error': {}}
+        for _ in range(2):
+            self._frontend._settings['user_id'] = ''
+            backend = DeezerBackend(self._frontend, self)
+            backend._load_json('http://api.deezer.com/album/album-id')
+        self.assertEqual(4, len(self._requests))
+
+    def test_cache_can_be_bypassed_and_cleared(self):
+        backend = DeezerBackend(self._frontend, self)
+        list(backend.my_playlists())
+        backend.clear_cache()
+        list(backend.my_playlists())
+        self._frontend._settings['response_cache'] = 'false'
+        list(DeezerBackend(self._frontend, self).my_playlists())
+        self.assertEqual(3, len(self._requests))
+
+    def test_stale_response_is_served_and_revalidated(self):
+        backend = DeezerBackend(self._frontend, self)
+        url = 'https://api.deezer.com/user/user-id/albums?&limit=20&index=0'
+        backend._response_cache.set(backend._cache_key(url, {}), {'data': [], 'total': 1}, -1)
+        list(backend.my_albums())
+        self.assertEqual([], self._requests)
+        target = self._frontend._background.pop()
+        self.assertEqual({'mode': 'revalidate', 'url': url, 'params': '{}', 'auth': True}, target)
+        list(DeezerBackend(self._frontend, self).my_albums())
+        self.assertEqual([], self._frontend._background)
+        Addon(backend, self._frontend).render('?' + urllib.urlencode(target))
+        self.assertEqual([(url, {'access_token': 'token'})], self._requests)
+        self.assertEqual({'data': [], 'total': 0}, backend._response_cache.get(backend._cache_key(url, {})))
+
+    def test_only_api_urls_are_revalidated(self):
+        backend = DeezerBackend(self._frontend, self)
+        for url in ('http://127.0.0.1:8000/x', 'https://api.deezer.com.example.org/user/me', 'file:///etc/passwd'):
+            self.assertRaises(ValueError, Addon(backend, self._frontend).render,
+                              '?' + urllib.urlencode({'mode': 'revalidate', 'url': url, 'auth': 'True'}))
+        self.assertEqual([], self._requests)
+
+    def test_revalidation_lease_keeps_the_expiry(self):
+        backend = DeezerBackend(self._frontend, self)
+        url = 'https://api.deezer.com/user/user-id/albums?&limit=20&index=0'
+        key = backend._cache_key(url, {})
+        backend._response_cache.set(key, {'data': [], 'total': 1}, -24 * 60 * 60 + 60)
+        list(backend.my_albums())
+        self.assertEqual(1, len(self._frontend._background))
+        self.assertAlmostEqual(-24 * 60 * 60 + 60, backend._response_cache.get_entry(key)[2])
+        self.assertFalse(backend._response_cache.lease(key, 60))
+
+    def test_expired_response_beyond_max_stale_age_is_reloaded(self):
+        backend = DeezerBackend(self._frontend, self)
+        url = 'https://api.deezer.com/user/user-id/albums?&limit=20&index=0'
+        backend._response_cache.set(backend._cache_key(url, {}), {'data': [], 'total': 1}, -2 * 24 * 60 * 60)
+        list(backend.my_albums())
+        self.assertEqual(1, len(self._requests))
+        self.assertEqual([], self._frontend._background)
+
+class TestLibrary(unittest.TestCase):
+
+    URL = 'https://api.deezer.com/user/user-id/albums?limit=100&index=%i'
+
+    def setUp(self):
+        self._frontend = MockFrontend()
+        self._frontend._settings.update({'access_token': 'token', 'user_id': 'user-id', 'response_cache': 'false'})
+        self._frontend._profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._frontend._profile_dir)
+        self._albums = [self._album(index) for index in range(150)]
+        self._requests = []
+
+    @staticmethod
+    def _album(index):
+        return {'id': str(index), 'title': 'album %03i' % index, 'cover_big': 'cover',
+                'release_date': '%i-01-01' % (1900 + index % 7), 'time_add': 1000 - index}
+
+    def load_json(self, url, params={}):
+        self._requests.append(url)
+        if url.startswith('http://api.deezer.com/album/'):
+            album = dict(self._album(int(url.split('/')[-1])), artist={'name': 'artist'}, tracks={'data': []})
+            del album['time_add']
+            return album
+        index = int(url.rsplit('=', 1)[1])
+        return {'data': self._albums[index:index + 100], 'total': len(self._albums)}
+
+    def load_json_many(self, urls, params={}):
+        return [self.load_json(url, params) for url in urls]
+
+    def _backend(self):
+        backend = DeezerBackend(self._frontend, self)
+        self.addCleanup(backend._library.close)
+        return backend
+
+    def test_favourites_are_prefetched_from_the_library(self):
+        del self._frontend._settings['response_cache']
+        messages = []
+        self._frontend.log = messages.append
+        backend = self._backend()
+        Addon(backend, self._frontend).render('?mode=my_albums')
+        backend.prefetch_thread.join()
+        self.assertEqual([], [message for message in messages if 'prefetch failed' in message])
+        self.assertIn('http://api.deezer.com/album/0', self._requests)
+
+    def test_favourites_are_served_from_the_library(self):
+        albums = list(self._backend().my_albums(page=1))
+        self.assertEqual([self.URL % 0, self.URL % 100], self._requests)
+        self.assertEqual('album 020', albums[0]['label'].split(' (')[0])
+        self.assertEqual({'mode': 'my_albums', 'page': 2}, albums[-1]['target'])
+        del self._requests[:]
+        albums = list(self._backend().my_albums(sort='name', all_items=True))
+        self.assertEqual([], self._requests)
+        self.assertEqual(150, len(albums))
+        self.assertEqual({'mode': 'album', 'album_id': '0'}, albums[0]['target'])
+
+    def test_sync_only_loads_new_favourites(self):
+        backend = self._backend()
+        backend.sync_library('albums')
+        self._albums.insert(0, dict(self._album(150), time_add=2000))
+        del self._requests[:]
+        backend.sync_library('albums')
+        self.assertEqual([self.URL % 0], self._requests)
+        years = [album['release_date'][:4] for album in backend._library.items('albums', 'year')]
+        self.assertEqual(sorted(years, reverse=True), years)
+        self.assertEqual('150', backend._library.items('albums', limit=1)[0]['id'])
+
+    def test_removed_favourites_trigger_a_full_sync(self):
+        backend = self._backend()
+        backend.sync_library('albums')
+        del self._albums[120]
+        backend.sync_library('albums')
+        self.assertEqual(149, backend._library.count('albums'))
+
+    def test_error_answers_keep_the_library(self):
+        backend = self._backend()
+        backend.sync_library('albums')
+        synced = backend._library.synced('albums')
+        self.load_json = lambda url, params={}: {'error': {'message': 'Quota limit exceeded', 'code': 4}}
+        self.assertRaises(IOError, backend.sync_library, 'albums')
+        self.assertEqual((150, synced), (backend._library.count('albums'), backend._library.synced('albums')))
+
+    def test_likes_are_written_through(self):
+        backend = self._backend()
+        backend.sync_library('albums')
+        session = MockSession(['true', 'true'])
+        backend._transport = Transport(session)
+        backend.unlike_album('3')
+        self.assertEqual(149, backend._library.count('albums'))
+        backend.like_album('3')
+        self.assertEqual('album 003', backend._library.items('albums', limit=1)[0]['title'])
+        self.assertEqual(('https://api.deezer.com/user/user-id/albums',
+                          {'album_id': '3', 'access_token': 'token', 'request_method': 'POST'}),
+                         session.requests[1][:2])
+
+    def test_bulk_unlike_reports_once_and_drops_cached_pages(self):
+        self._frontend._settings['response_cache'] = 'true'
+        backend = self._backend()
+        backend.sync_library('albums')
+        backend._load_json('https://api.deezer.com/user/user-id/albums?&limit=20&index=0', {'access_token': 'token'})
+        session = MockSession([])
+        session.get = lambda url, params=None, timeout=None: MockResponse(
+            'true' if params['album_id'] != '2' else '{"error": {"code": 800}}')
+        backend._transport = Transport(session)
+        items = list(backend.my_albums(like=False))
+        self.assertEqual({'mode': 'unlike_all', 'kind': 'albums', 'ids': ','.join(str(index) for index in range(20))},
+                         items[-2]['target'])
+        backend.unlike_all('albums', '1,2,3')
+        self.assertEqual(['2 of 3 albums unliked'], self._frontend._notifications)
+        self.assertEqual(148, backend._library.count('albums'))
+        self.assertEqual(0, len(list(backend._response_cache.values())))
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._index = SearchIndex(os.path.join(self._dir, 'search.db'), max_entries=3)
+        self.addCleanup(self._index.close)
+
+    @staticmethod
+    def _artist(artist_id, name):
+        return {'id': artist_id, 'name': name, 'picture_big': 'picture', 'type': 'artist'}
+
+    def test_prefix_and_typos_match(self):
+        self._index.collect({'data': [self._artist(1, 'Daft Punk'), self._artist(2, 'Dave Brubeck')]})
+        self.assertEqual(2, self._index.flush())
+        self.assertEqual([1, 2], sorted(data['id'] for _, data in self._index.search('da')))
+        self.assertEqual([1], [data['id'] for _, data in self._index.search('daft pun')])
+        self.assertEqual([2], [data['id'] for _, data in self._index.search('brubek')])
+        self.assertEqual([], self._index.search('mozart'))
+
+    def test_album_tracks_are_indexed_and_size_is_capped(self):
+        album = {'id': 7, 'title': 'Discovery', 'cover_big': 'cover', 'type': 'album',
+                 'artist': {'id': 1, 'name': 'Daft Punk'},
+                 'tracks': {'data': [{'id': 70 + index, 'title': 'One More Time', 'duration': 320, 'type': 'track'}
+                                     for index in range(3)]}}
+        self._index.collect(album)
+        self._index.flush()
+        self.assertEqual(3, self._index.connection.execute('SELECT COUNT(*) FROM items').fetchone()[0])
+        kind, data = self._index.search('one more')[0]
+        self.assertEqual(('track', 'Discovery'), (kind, data['album']['title']))
+
+    def test_evicted_words_are_not_suggested(self):
+        self._index.collect(self._artist(1, 'Brubeck'))
+        self._index.flush()
+        self._index.collect([self._artist(index, 'Daft Punk') for index in range(2, 5)])
+        self._index.flush()
+        terms = [term for term, in self._index.connection.execute('SELECT term FROM terms ORDER BY term')]
+        self.assertEqual(['daft', 'punk'], terms)
+        self.assertEqual([], self._index.search('brubek'))
+
+    def test_search_sections_are_prefetched(self):
+        frontend = MockFrontend()
+        frontend._profile_dir = self._dir
+        messages = []
+        frontend.log = messages.append
+        def load_json(_, url, params={}):
+            if '/search/artist?' in url:
+                return {'data': [self._artist(1, 'Daft Punk')], 'total': 1}
+            return {'data': [], 'total': 0}
+        requester = type('Requester', (object,), {
+            'load_json': load_json,
+            'load_json_many': lambda self, urls, params={}: [load_json(self, url, params) for url in urls]})()
+        backend = DeezerBackend(frontend, requester)
+        Addon(backend, frontend).render('?mode=search_all&query=daft')
+        backend.prefetch_thread.join()
+        self.assertEqual([], [message for message in messages if 'prefetch failed' in message])
+        self.assertEqual([u'\u2605 Daft Punk'], [item['label'] for item in backend.search('daft', kind='artist')])
+
+    def test_local_hits_are_listed_first(self):
+        frontend = MockFrontend()
+        frontend._profile_dir = self._dir
+        frontend._settings['response_cache'] = 'false'
+        responses = {'http://api.deezer.com/search/artist?q=daft&limit=20&index=0': {
+            'data': [self._artist(1, 'Daft Punk'), self._artist(3, 'Daftside')], 'total': 2}}
+        requester = type('Requester', (object,), {'load_json': lambda _, url, params={}: responses[url]})()
+        backend = DeezerBackend(frontend, requester)
+        backend._search_index.collect(self._artist(1, 'Daft Punk'))
+        backend.finish()
+        labels = [item['label'] for item in backend.search('daft')]
+        self.assertEqual([u'\u2605 Daft Punk', 'Daftside'], labels)
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self._frontend = MockFrontend()
+        self._frontend._profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._frontend._profile_dir)
+        self._requests = []
+        self._delay = 0
+
+    def load_json(self, url, params={}):
+        self._requests.append(url)
+        if '/chart/' in url:
+            albums = [{'id': str(i), 'title': 'album', 'cover_big': 'cover'} for i in range(5)]
+            return {'albums': {'data': albums}}
+        tracks = [{'id': 'track-id', 'title': 'track', 'duration': 1}]
+        time.sleep(self._delay)
+        album_id = url.rsplit('/', 1)[-1]
+        return {'id': album_id, 'type': 'album', 'title': 'album ' + album_id, 'cover_big': 'cover',
+                'artist': {'name': 'artist'}, 'tracks': {'data': tracks}}
+
+    def load_json_many(self, urls, params={}):
+        return [self.load_json(url, params) for url in urls]
+
+    def _render(self, query):
+        backend = DeezerBackend(self._frontend, self)
+        Addon(backend, self._frontend).render(query)
+        if backend.prefetch_thread:
+            backend.prefetch_thread.join()
+        return backend
+
+    def test_next_page_and_first_entries_are_prefetched(self):
+        self._frontend._settings['prefetch_entries'] = '2'
+        self._render('?mode=albums')
+        self.assertEqual([
+            'http://api.deezer.com/chart/0?limit=20&index=0',
+            'http://api.deezer.com/chart/0?limit=20&index=20',
+            'http://api.deezer.com/album/0',
+            'http://api.deezer.com/album/1'
+        ], self._requests)
+        self._frontend._settings['prefetch'] = 'false'
+        self._render('?mode=album&album_id=1')
+        self.assertEqual(4, len(self._requests))
+        stats = json.load(open(os.path.join(self._frontend._profile_dir, Prefetcher.STATS_FILE)))
+        self.assertEqual((1, 3), (stats['hits'], stats['prefetched']))
+
+    def test_budget_limits_prefetching(self):
+        self._frontend._settings['prefetch_budget'] = '2'
+        self._render('?mode=albums&page=1')
+        self.assertEqual(3, len(self._requests))
+
+    def test_prefetched_items_are_indexed(self):
+        self._frontend._settings['prefetch_entries'] = '2'
+        # album responses arrive after the invocation finished
+        self._delay = 0.05
+        self._render('?mode=albums')
+        index = SearchIndex(os.path.join(self._frontend._profile_dir, 'search.db'))
+        self.assertEqual(['album 1', 'album 0'], sorted(data['title'] for _, data in index.search('album'))[::-1])
+        index.close()
+
+    def test_background_modes_keep_prefetching(self):
+        backend = DeezerBackend(self._frontend, self)
+        backend.navigate('albums')
+        path = os.path.join(self._frontend._profile_dir, Prefetcher.GENERATION_FILE)
+        generation = open(path).read()
+        for mode in DeezerBackend.BACKGROUND_MODES:
+            backend.navigate(mode)
+        self.assertEqual(generation, open(path).read())
+
+    def test_navigation_cancels_prefetcher(self):
+        directory = self._frontend._profile_dir
+        prefetcher = Prefetcher(directory, Prefetcher.navigated(directory), 10, lambda message: None)
+        prefetcher.spend(1)
+        Prefetcher.navigated(directory)
+        self.assertRaises(PrefetchCancelled, prefetcher.spend, 1)
+
+class MockResponse(object):
+    '''mock http response'''
+
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.content = text
+        self.status_code = status_code
+
+class MockSession(object):
+    '''mock requests session recording the requests'''
+
+    def __init__(self, responses):
+        self.requests = []
+        self._responses = responses
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append((url, params, timeout))
+        return MockResponse(self._responses.pop(0))
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._sleeps = []
+
+    def _limiter(self):
+        return RateLimiter(self._dir, rate=10, burst=3, sleep=self._sleeps.append)
+
+    def test_bucket_is_shared_between_processes(self):
+        first, second = self._limiter(), self._limiter()
+        self.assertEqual([0, 0, 0], [first.acquire(), second.acquire(), first.acquire()])
+        self.assertAlmostEqual(0.1, second.acquire(), places=1)
+        self.assertAlmostEqual(0.2, first.acquire(), places=1)
+        self.assertEqual(2, len(self._sleeps))
+
+    def test_quota_errors_back_off_exponentially(self):
+        limiter = self._limiter()
+        self.assertEqual([1.0, 2.0, 4.0], [limiter.quota_exceeded() for _ in range(3)])
+        self.assertGreater(self._limiter().acquire(), 3.5)
+
+    def test_backend_retries_after_quota_error(self):
+        frontend = MockFrontend()
+        frontend._profile_dir = self._dir
+        frontend._settings['response_cache'] = 'false'
+        session = MockSession(['{"error":{"type":"Exception","message":"Quota limit exceeded","code":4}}',
+                               '{"id": "album-id"}'])
+        backend = DeezerBackend(frontend, transport=Transport(session))
+        backend._rate_limiter._sleep = self._sleeps.append
+        self.assertEqual({'id': 'album-id'}, backend.load_json('http://api.deezer.com/album/album-id'))
+        self.assertEqual(2, len(session.requests))
+        self.assertAlmostEqual(1.0, self._sleeps[-1], places=1)
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self._frontend = MockFrontend()
+        self._frontend._settings['access_token'] = 'token'
+        self._frontend._settings['user_id'] = 'user-id'
+
+    def test_backend_requests_use_transport(self):
+        session = MockSession(['{"id": "album-id"}', 'ok'])
+        backend = DeezerBackend(self._frontend, transport=Transport(session, timeout=3))
+        self.assertEqual({'id': 'album-id'}, backend.load_json('http://api.deezer.com/album/album-id'))
+        backend.unlike_album('album-id')
+        self.assertEqual([
+            ('http://api.deezer.com/album/album-id', {}, 3),
+            ('https://api.deezer.com/user/user-id/albums',
+             {'album_id': 'album-id', 'access_token': 'token', 'request_method': 'DELETE'}, 3)
+        ], session.requests)
+
+    def test_user_id_is_loaded_through_requester(self):
+        self._frontend._settings['user_id'] = ''
+        session = MockSession(['{"id": "me"}'])
+        backend = DeezerBackend(self._frontend, transport=Transport(session))
+        self.assertEqual('me', backend._user_id)
+        self.assertEqual('me', self._frontend._settings['user_id'])
+
+    def test_session_retries_transient_errors(self):
+        session = Transport(retries=3, pool_size=2).session
+        adapter = session.get_adapter('https://api.deezer.com/')
+        self.assertEqual(3, adapter.max_retries.total)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertIn('gzip', session.headers['Accept-Encoding'])
+
+    def test_likes_are_sent_once(self):
+        transport = Transport(retries=3)
+        adapter = transport.single_session.get_adapter('https://api.deezer.com/')
+        self.assertEqual(0, adapter.max_retries.total)
+        transport._session, transport._single_session = MockSession([]), MockSession(['true'])
+        DeezerBackend(self._frontend, transport=transport).like_album('album-id')
+        self.assertEqual(1, len(transport._single_session.requests))
+
+class TestStartup(unittest.TestCase):
+    '''cold start of default.py against stubbed kodi modules'''
+
+    # time budget of a plugin invocation without network access
+    BUDGET = 0.5
+    SCRIPT = '''
+import json, sys, time
+start = time.time()
+from lib import xbmcstub
+stub = xbmcstub.install(json.loads(sys.argv[2]))
+sys.argv = ['plugin://plugin.audio.streamer/', '1', sys.argv[1]]
+execfile('default.py')
+print(json.dumps({
+    'seconds': time.time() - start,
+    'modules': [name for name in ('requests', 'inspect', 'random') if name in sys.modules],
+    'addon_objects': len(stub.called('Addon')),
+    'directory_items': [len(args[1]) for args in stub.called('addDirectoryItems')]
+}))
+'''
+
+    def _start(self, query, settings={}):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(
+            [sys.executable, '-c', self.SCRIPT, query, json.dumps(settings)], cwd=root)
+        return json.loads(output.splitlines()[-1])
+
+    def test_root_menu_starts_fast(self):
+        result = self._start('', {'stream_url': 'http://stream/{track_id}'})
+        self.assertEqual([], result['modules'])
+        self.assertEqual(1, result['addon_objects'])
+        self.assertEqual([3], result['directory_items'])
+        self.assertLess(result['seconds'], self.BUDGET)
+
+    def test_play_with_stream_url_starts_fast(self):
+        result = self._start('?mode=play&track_id=1', {'stream_url': 'http://stream/{track_id}'})
+        self.assertEqual([], result['modules'])
+        self.assertLess(result['seconds'], self.BUDGET)
+
+class TestKodiFrontend(unittest.TestCase):
+    '''rendering against stubbed kodi modules'''
+
+    def setUp(self):
+        from lib import xbmcstub
+        self._stub = xbmcstub.install()
+        sys_argv = sys.argv
+        sys.argv = ['plugin://plugin.audio.streamer/', '1', '']
+        try:
+            from lib.kodi_frontend import KodiFrontend
+            self._frontend = KodiFrontend()
+        finally:
+            sys.argv = sys_argv
+
+    @staticmethod
+    def _items(count):
+        for index in range(count):
+            yield {'label': 'item %i' % index, 'target': {'mode': 'album', 'album_id': index}}
+
+    def test_items_are_submitted_in_chunks(self):
+        self._frontend.set_total_items(120)
+        self._frontend.render(self._items(120), {'content': 'albums', 'cache': True, 'update_listing': True})
+        submitted = self._stub.called('addDirectoryItems')
+        self.assertEqual([50, 50, 20], [len(args[1]) for args in submitted])
+        self.assertEqual([120] * 3, [args[2] for args in submitted])
+        self.assertEqual([(1, 'albums')], self._stub.called('setContent'))
+        self.assertEqual([((1,), {'updateListing': True, 'cacheToDisc': True})],
+                         self._stub.called_with('endOfDirectory'))
+
+    def test_failed_listing_is_not_cached(self):
+        def failing():
+            for item in self._items(3):
+                yield item
+            raise ValueError('api error')
+        self.assertRaises(ValueError, self._frontend.render, failing(), {'cache': True})
+        self.assertEqual([3], [len(args[1]) for args in self._stub.called('addDirectoryItems')])
+        self.assertFalse(self._stub.called_with('endOfDirectory')[0][1]['cacheToDisc'])
+
+class TestResidentService(unittest.TestCase):
+    '''plugin invocations answered by the backend of the service'''
+
+    ALBUM = json.dumps({
+        'id': 'album-id', 'title': 'album-title', 'cover_big': 'cover', 'release_date': '2001-01-01',
+        'artist': {'name': 'artist-name'},
+        'tracks': {'data': [{'id': 'track-id', 'title': 'track-title', 'duration': '60'}]}
+    })
+
+    def setUp(self):
+        from lib import xbmcstub
+        self._stub = xbmcstub.install({'user_id': 'user-id', 'access_token': 'token',
+                                       'stream_url': 'http://stream/{track_id}'})
+        sys_argv = sys.argv
+        sys.argv = ['plugin://plugin.audio.streamer/', '1', '']
+        try:
+            from lib.kodi_frontend import KodiFrontend
+            self._frontend = KodiFrontend()
+        finally:
+            sys.argv = sys_argv
+        self._session = MockSession([])
+        self._backends = []
+        self._service = ResidentService(
+            self._backend, ResidentFrontend(xbmcstub.Addon(), lambda message: None), port=0).start()
+        self.addCleanup(self._service.stop)
+
+    def _backend(self, frontend):
+        self._backends.append(DeezerBackend(frontend, transport=Transport(self._session)))
+        return self._backends[-1]
+
+    def test_invocations_are_replayed_and_share_the_backend(self):
+        self._session._responses.extend([self.ALBUM, self.ALBUM])
+        for _ in range(2):
+            self.assertTrue(forward(self._frontend, '?mode=album&album_id=album-id', self._service.port))
+        self.assertEqual([1, 1], [len(args[1]) for args in self._stub.called('addDirectoryItems')])
+        url, list_item, folder = self._stub.called('addDirectoryItems')[0][1][0]
+        self.assertEqual(('plugin://plugin.audio.streamer/?mode=play&track_id=track-id', 'track-title', False),
+                         (url, list_item.label, folder))
+        self.assertEqual(1, len(self._backends))
+        self._service.settings_changed()
+        self.assertTrue(forward(self._frontend, '?mode=play&track_id=1', self._service.port))
+        self.assertEqual(2, len(self._backends))
+        self.assertEqual('http://stream/1', self._stub.called('setResolvedUrl')[0][2].path)
+
+    def test_prefetching_ends_with_the_invocation(self):
+        from lib import xbmcstub
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self._service.stop()
+        self._service = ResidentService(
+            self._backend, ResidentFrontend(xbmcstub.Addon(), lambda message: None, profile_dir), port=0).start()
+        self.addCleanup(self._service.stop)
+        albums = json.dumps({'albums': {'data': [
+            {'id': str(index), 'title': 'album', 'cover_big': 'cover'} for index in range(5)]}})
+        self._session.get = lambda url, params=None, timeout=None: MockResponse(
+            albums if '/chart/' in url else self.ALBUM)
+        self.assertTrue(forward(self._frontend, '?mode=albums', self._service.port))
+        self.assertTrue(forward(self._frontend, '?mode=album&album_id=777', self._service.port))
+        self.assertEqual([('set_total_items', [1])],
+                         [call for call in self._service._frontend.calls if call[0] == 'set_total_items'])
+        self.assertEqual(1, len(self._stub.called('addDirectoryItems')[-1][1]))
+
+    def test_plugin_runs_what_the_service_cannot(self):
+        self.assertFalse(forward(self._frontend, '?mode=search', self._service.port))
+        self.assertRaises(RuntimeError, forward, self._frontend, '?mode=nothing', self._service.port)
+        self.assertEqual(2, self._service.invocations)
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+        self.assertFalse(forward(self._frontend, '?mode=album&album_id=1', port))
+
+class Mp3Handler(BaseHTTPRequestHandler):
+    '''serves the bytes of the stub server with range support'''
+
+    def do_GET(self):
+        data = self.server.data
+        self.server.requests.append(self.headers.get('Range'))
+        first = 0
+        if self.headers.get('Range'):
+            first = int(self.headers['Range'][len('bytes='):].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %i-%i/%i' % (first, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(data) - first))
+        self.end_headers()
+        self.wfile.write(data[first:])
+
+    def log_message(self, format, *args):
+        pass
+
+class UnsizedHandler(BaseHTTPRequestHandler):
+    '''serves the bytes of the stub server without a length, the second half after a delay'''
+
+    def do_GET(self):
+        half = len(self.server.data) // 2
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.end_headers()
+        self.wfile.write(self.server.data[:half])
+        self.wfile.flush()
+        time.sleep(self.server.delay)
+        self.wfile.write(self.server.data[half:])
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    '''local http server for tests'''
+    daemon_threads = True
+
+    def __init__(self, handler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%i%s' % (self.server_address[1], path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    '''answers with the next (delay, status) of the script of the stub server'''
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        delay, status = self.server.script.pop(0) if self.server.script else (0, 200)
+        time.sleep(delay)
+        body = '{"id": "album-id"}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestResilience(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._server = StubServer(FlakyHandler)
+        self._server.script = []
+        self.addCleanup(self._server.stop)
+        self._latencies = Latencies(self._dir)
+        self._resilience = Resilience(CircuitBreaker(self._dir, threshold=2), self._latencies, sleep=lambda _: None)
+        transport = Transport(retries=0)
+        self._send = lambda timeout: transport.get(self._server.url('/album'), timeout=timeout)
+
+    def _get(self, budget=5):
+        return self._resilience.get(self._send, self._server.url('/album'), 'api', budget)
+
+    def test_server_errors_are_retried(self):
+        self._server.script = [(0, 503), (0, 502)]
+        self.assertEqual(200, self._get().status_code)
+        self.assertEqual(3, len(self._server.requests))
+
+    def test_slow_requests_are_hedged(self):
+        for _ in range(20):
+            self._latencies.add('api', 0.02)
+        self._server.script = [(2, 200)]
+        start = time.time()
+        self.assertEqual(200, self._get().status_code)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(1, self._resilience.hedged)
+
+    def test_budget_limits_slow_requests(self):
+        self._server.script = [(1, 200)]
+        self.assertRaises(IOError, self._get, 0.3)
+
+    def test_open_circuit_is_shared_and_serves_cached_responses(self):
+        self._server.script = [(0, 503)] * 6
+        self.assertRaises(IOError, self._get)
+        self.assertRaises(IOError, self._get)
+        requests = len(self._server.requests)
+        self.assertRaises(CircuitOpen, CircuitBreaker(self._dir).check, '127.0.0.1:%i' % self._server.server_address[1])
+        self.assertRaises(CircuitOpen, self._get)
+        self.assertEqual(requests, len(self._server.requests))
+
+        frontend = MockFrontend()
+        frontend._profile_dir = self._dir
+        backend = DeezerBackend(frontend)
+        url = 'http://api.deezer.com/album/album-id'
+        backend._response_cache.set(backend._cache_key(url, {}), {'id': 'album-id'}, -1000)
+        for _ in range(5):
+            backend._resilience._breaker.failed('api.deezer.com')
+        self.assertEqual({'id': 'album-id'}, backend._load_json(url))
+        self.assertRaises(CircuitOpen, backend._load_json, 'http://api.deezer.com/album/other')
+
+class TestArtworkCache(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._server = StubServer(Mp3Handler)
+        self._server.data = b'image'
+        self.addCleanup(self._server.stop)
+
+    def test_images_are_downloaded_while_rendering_and_evicted(self):
+        cache = ArtworkCache(self._dir, max_entries=2, workers=2)
+        urls = [self._server.url('/cover/%i.jpg' % index) for index in range(3)]
+        self.assertEqual(urls, [cache.path(url) for url in urls])
+        cache.finish()
+        self.assertEqual(3, cache.downloaded)
+        self.assertEqual(2, len(os.listdir(self._dir)))
+        cached = ArtworkCache(self._dir).path(urls[2])
+        self.assertTrue(cached.startswith(self._dir))
+        with open(cached, 'rb') as image:
+            self.assertEqual(b'image', image.read())
+
+    def test_image_sizes_follow_settings(self):
+        frontend = MockFrontend()
+        frontend._settings.update({'thumb_size': 'small', 'fanart_size': 'xl'})
+        backend = DeezerBackend(frontend, self)
+        album = {'id': 'album-id', 'title': 'title', 'cover_small': 's', 'cover_medium': 'm', 'cover_big': 'b', 'cover_xl': 'x'}
+        self.assertEqual(('s', 'x'), (backend._extract_album(album).thumb, backend._extract_album(album).fanart))
+        del album['cover_small'], album['cover_xl']
+        self.assertEqual(('m', 'b'), backend._images(album, 'cover'))
+        self.assertEqual(('b', None), backend._images({'cover_big': 'b'}, 'cover'))
+
+class TestStreamProxy(unittest.TestCase):
+
+    def setUp(self):
+        self._upstream = StubServer(Mp3Handler)
+        self._upstream.data = b''.join(chr(i % 251) for i in range(300 * 1024))
+        self.addCleanup(self._upstream.stop)
+        self._proxy = StreamProxy(Transport(), capacity=64 * 1024, prefill=16 * 1024)
+        self._proxy.start()
+        self.addCleanup(self._proxy.stop)
+        self._url = self._upstream.url('/track.mp3')
+
+    def _get(self, path='stream', headers={}):
+        request = urllib2.Request(proxy_url(self._proxy.port, self._url, path), headers=headers)
+        return urllib2.urlopen(request, timeout=10)
+
+    def test_stream_through_bounded_buffer(self):
+        response = self._get()
+        self.assertEqual(str(300 * 1024), response.info()['Content-Length'])
+        self.assertEqual(self._upstream.data, response.read())
+
+    def test_range_request(self):
+        response = self._get(headers={'Range': 'bytes=1000-1999'})
+        self.assertEqual(206, response.getcode())
+        self.assertEqual('bytes 1000-1999/%i' % (300 * 1024), response.info()['Content-Range'])
+        self.assertEqual(self._upstream.data[1000:2000], response.read())
+
+    def test_seek_outside_buffer_restarts_upstream(self):
+        self.assertEqual(self._upstream.data[:100], self._get(headers={'Range': 'bytes=0-99'}).read())
+        self.assertEqual(self._upstream.data[250000:], self._get(headers={'Range': 'bytes=250000-'}).read())
+        self.assertEqual([None, 'bytes=250000-'], self._upstream.requests)
+
+    def test_stream_without_length_starts_at_once(self):
+        upstream = StubServer(UnsizedHandler)
+        upstream.data, upstream.delay = self._upstream.data[:100 * 1024], 1
+        self.addCleanup(upstream.stop)
+        self._url = upstream.url('/track.mp3')
+        start = time.time()
+        response = self._get()
+        self.assertEqual(upstream.data[:1024], response.read(1024))
+        self.assertLess(time.time() - start, upstream.delay)
+        self.assertEqual(upstream.data[1024:], response.read())
+
+    def test_prefilled_track_is_served_from_buffer(self):
+        self.assertEqual(204, self._get('prefill').getcode())
+        self.assertEqual(self._upstream.data, self._get().read())
+        self.assertEqual([None], self._upstream.requests)
+
+    def test_play_hands_proxy_url_to_kodi(self):
+        frontend = MockFrontend()
+        frontend._settings.update({
+            'stream_proxy': 'true',
+            'stream_proxy_port': str(self._proxy.port),
+            'stream_url': self._upstream.url('/{track_id}.mp3')
+        })
+        DeezerBackend(frontend, transport=Transport()).play('1', next_track_id='2')
+        self.assertEqual(proxy_url(self._proxy.port, self._upstream.url('/1.mp3')), frontend._resolved)
+        self.assertEqual([self._upstream.url('/2.mp3')], [buffer.url for buffer in self._proxy._buffers])
+        self.assertEqual(self._upstream.data, urllib2.urlopen(frontend._resolved, timeout=10).read())
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        catalogue = benchmark.Catalogue(album_size=7, playlist_length=30)
+        self._server = benchmark.StubApiServer(catalogue).start()
+        self.addCleanup(self._server.stop)
+        self._settings = {'access_token': 'token', 'user_id': 'user-id'}
+
+    def test_modes_render_against_stub_api(self):
+        for query, items, requests in (('?mode=album&album_id=3', 7, 1),
+                                       ('?mode=playlist&playlist_id=1', 31, 1),
+                                       ('?mode=artist_albums&artist_id=1', 21, 2)):
+            requests_before = self._server.requests
+            result = benchmark.run_mode(self._server.url, query, self._settings)
+            self.assertEqual((items, requests), (result['items'], self._server.requests - requests_before))
+
+    def test_compare_flags_regressions(self):
+        baseline = {'album': {'requests': 1, 'seconds': 0.1, 'peak_kb': 1000}}
+        results = {'album': {'requests': 2, 'seconds': 0.1, 'peak_kb': 1100}}
+        lines, regressions = benchmark.compare(results, baseline, 0.2)
+        self.assertEqual(3, len(lines))
+        self.assertEqual(1, regressions)
+
+    def test_records_take_less_memory_than_dicts(self):
+        result = benchmark.item_memory(500)
+        self.assertLess(result['records_kb'] * 2, result['dicts_kb'])
+
+    def test_routing_paths_build_the_same_next_page(self):
+        args = benchmark._parse(benchmark.ROUTING_QUERY)
+        args.pop('mode')
+        self.assertEqual({'mode': 'artist_albums', 'artist_id': '1', 'page': 3, 'like': False},
+                         benchmark.artist_albums(**args))
+        result = benchmark.routing(50)
+        self.assertGreater(result['routes_us'], 0)
+
+class TestItems(unittest.TestCase):
+
+    def test_tracks_share_their_album(self):
+        first = Track('1', 'one', 60, AlbumRef.get(u'album', u'artist', 'cover', '2001'), 1)
+        second = Track('2', 'two', 60, AlbumRef.get(u'album', u'artist', 'cover', '2001'), 2)
+        self.assertIs(first.album, second.album)
+        self.assertEqual('artist', second['artist'])
+        self.assertEqual({'mode': 'play', 'track_id': '2'}, second['target'])
+        self.assertNotIn('tracknumber', Track('3', 'three', 60, first.album))
+
+    def test_records_compare_like_dicts(self):
+        item = {'label': 'page 2', 'target': {'mode': 'albums', 'page': 1}}
+        self.assertEqual(item, Entry('page 2', {'mode': 'albums', 'page': 1}))
+        self.assertEqual(item, from_dict(item))
+        self.assertNotEqual(item, Entry('page 2', {'mode': 'albums', 'page': 1}, 'thumb'))
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+    def test_invocation_is_traced(self):
+        frontend = MockFrontend()
+        frontend._settings.update({'tracing': 'true', 'response_cache': 'false'})
+        frontend._profile_dir = self._dir
+        content = json.dumps({'data': [{'id': 'a', 'name': 'artist', 'picture_big': 'pic'}], 'total': 1})
+        session = MockSession([content])
+        addon = Addon(DeezerBackend(frontend, transport=Transport(session)), frontend)
+        addon.render('?mode=search&query=abc')
+        with open(os.path.join(self._dir, Tracer.TRACE_FILE)) as trace_file:
+            record = json.loads(trace_file.read())
+        self.assertEqual('search', record['mode'])
+        self.assertEqual(['route', 'render', 'http', 'json', 'index'], [span['name'] for span in record['spans']])
+        self.assertEqual(1, record['spans'][1]['items'])
+        http = record['spans'][2]
+        self.assertEqual((200, len(content)), (http['status'], http['bytes']))
+        self.assertEqual({'query': 'abc'}, record['spans'][0]['args'])
+        summary = json.load(open(os.path.join(self._dir, Tracer.SUMMARY_FILE)))
+        self.assertEqual(1, summary['search']['invocations'])
+        self.assertEqual(1, summary['search']['http_requests'])
+
+    def test_trace_file_is_rotated(self):
+        for _ in range(3):
+            tracer = Tracer(max_bytes=10, backups=1)
+            with tracer.span('route'):
+                pass
+            tracer.write(self._dir, mode='root')
+        self.assertTrue(os.path.exists(os.path.join(self._dir, Tracer.TRACE_FILE + '.1')))
+        self.assertFalse(os.path.exists(os.path.join(self._dir, Tracer.TRACE_FILE + '.2')))
+        summary = json.load(open(os.path.join(self._dir, Tracer.SUMMARY_FILE)))
+        self.assertEqual(3, summary['root']['invocations'])
+
+    def test_file_lock_is_exclusive(self):
+        path = os.path.join(self._dir, 'lock')
+        with FileLock(path):
+            self.assertRaises(IOError, FileLock(path, timeout=0.05).__enter__)
+        with FileLock(path, timeout=0.05):
+            pass
+
+class TestWorkers(unittest.TestCase):
+
+    def test_parallel_map_keeps_order(self):
+        self.assertEqual([x * 2 for x in range(20)], parallel_map(lambda x: x * 2, range(20), 3))
+
+    def test_parallel_map_raises_errors(self):
+        self.assertRaises(ValueError, parallel_map, int, ['1', 'x', '3'], 2)
+
+    def test_backend_loads_many_urls_concurrently(self):
+        session = MockSession(['{"index": 0}', '{"index": 1}'])
+        frontend = MockFrontend()
+        backend = DeezerBackend(frontend, transport=Transport(session))
+        self.assertEqual([{'index': 0}, {'index': 1}], sorted(backend.load_json_many(['a', 'b']), key=lambda data: data['index']))
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+    def test_expiry(self):
+        cache = DiskCache(self._dir)
+        cache.set('fresh', 'value', 60)
+        cache.set('expired', 'value', -1)
+        self.assertEqual('value', cache.get('fresh'))
+        self.assertEqual('value', DiskCache(self._dir).get('fresh'))
+        self.assertIsNone(cache.get('expired'))
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        self.assertEqual('value', cache.get_entry('expired')[0])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = DiskCache(self._dir, max_entries=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        os.utime(cache._path('a'), (1, 1))
+        cache.get('a')
+        os.utime(cache._path('b'), (2, 2))
+        cache.set('c', 3, 60)
+        self.assertEqual([1, None, 3], [cache.get(key) for key in 'abc'])
+
+    def test_corrupt_entry_is_dropped(self):
+        cache = DiskCache(self._dir)
+        cache.set('key', 'value', 60)
+        with open(cache._path('key'), 'w') as entry_file:
+            entry_file.write('{"key": "ke')
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(os.path.exists(cache._path('key')))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+"""Timing spans of a plugin invocation"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from lib.files import FileLock, read_json, remove, write_json
+
+class Tracer(object):
+    """Collects the timed spans of one plugin invocation.
+
+    Spans are always recorded, they are cheap. write() appends the
+    invocation as one json line to a rotating trace file and adds it to
+    summary counters aggregated over all invocations."""
+
+    TRACE_FILE = 'trace.log'
+    SUMMARY_FILE = 'trace_summary.json'
+
+    def __init__(self, max_bytes=1024 * 1024, backups=3):
+        self.spans = []
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        self._backups = backups
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """time the block, the yielded dict takes further attributes of the span"""
+        start = time.time()
+        record = dict(attributes, name=name)
+        try:
+            yield record
+        finally:
+            record['start_ms'] = round((start - self._start) * 1000, 2)
+            record['ms'] = round((time.time() - start) * 1000, 2)
+            with self._lock:
+                self.spans.append(record)
+
+    def record(self, **fields):
+        """the invocation as written to the trace file"""
+        result = dict(fields)
+        result['time'] = self._start
+        result['ms'] = round((time.time() - self._start) * 1000, 2)
+        with self._lock:
+            result['spans'] = sorted(self.spans, key=lambda span: span['start_ms'])
+        return result
+
+    def write(self, directory, **fields):
+        """append the invocation to the trace file and update the summary counters"""
+        record = self.record(**fields)
+        with FileLock(os.path.join(directory, 'trace.lock')):
+            path = os.path.join(directory, self.TRACE_FILE)
+            self._rotate(path)
+            with open(path, 'ab') as trace_file:
+                trace_file.write((json.dumps(record, sort_keys=True) + '\n').encode('utf-8'))
+            summary_path = os.path.join(directory, self.SUMMARY_FILE)
+            summary = read_json(summary_path, {})
+            self._summarize(summary, record)
+            write_json(summary_path, summary)
+        return record
+
+    def _rotate(self, path):
+        try:
+            if os.path.getsize(path) < self._max_bytes:
+                return
+        except OSError:
+            return
+        remove('%s.%i' % (path, self._backups))
+        for index in range(self._backups - 1, 0, -1):
+            if os.path.exists('%s.%i' % (path, index)):
+                os.rename('%s.%i' % (path, index), '%s.%i' % (path, index + 1))
+        os.rename(path, path + '.1')
+
+    @staticmethod
+    def _summarize(summary, record):
+        counters = summary.setdefault(record.get('mode') or 'root', {})
+        for key in ('invocations', 'errors', 'ms', 'max_ms', 'http_requests', 'http_bytes', 'http_ms'):
+            counters.setdefault(key, 0)
+        counters['invocations'] += 1
+        counters['errors'] += 1 if record.get('error') else 0
+        counters['ms'] += record['ms']
+        counters['max_ms'] = max(counters['max_ms'], record['ms'])
+        for span in record['spans']:
+            if span['name'] == 'http':
+                counters['http_requests'] += 1
+                counters['http_bytes'] += span.get('bytes', 0)
+                counters['http_ms'] += span['ms']
@@ -0,0 +1,59 @@
+"""HTTP transport shared by all backend requests"""
+
+class Transport(object):
+    """Keep-alive session with connection pooling, compression, timeouts and retries"""
+
+    RETRY_STATUS = (500, 502, 503, 504)
+
+    def __init__(self, session=None, timeout=10, retries=2, backoff=0.3, pool_size=4):
+        self._session = session
+        # a given session is used as it is, also for requests that must not be retried
+        self._single_session = session
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._pool_size = pool_size
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = self._create_session(self._retries)
+        return self._session
+
+    @property
+    def single_session(self):
+        """session sending every request once, for requests that change something"""
+        if self._single_session is None:
+            self._single_session = self._create_session(0) if self._retries else self.session
+        return self._single_session
+
+    def _create_session(self, retries):
+        # requests is imported on first use, most menus are served from the cache
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+        retry = Retry(
+            total=retries,
+            backoff_factor=self._backoff,
+            status_forcelist=self.RETRY_STATUS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        return session
+
+    def get(self, url, params=None, timeout=None, idempotent=True):
+        """GET the url, retrying transient failures of idempotent requests, and return the response"""
+        session = self.session if idempotent else self.single_session
+        return session.get(url, params=params, timeout=timeout or self._timeout)
+
+    def open(self, url, offset=0, timeout=None):
+        """GET the url as a stream starting at the byte offset"""
+        # byte offsets refer to the raw audio, never let it be compressed
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes=%i-' % offset
+        return self.session.get(url, headers=headers, stream=True, timeout=timeout or self._timeout)
@@ -0,0 +1,42 @@
+"""Bounded thread pool helpers"""
+
+import sys
+import threading
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+def parallel_map(function, items, workers=4):
+    """Apply function to all items on at most workers threads.
+
+    The results keep the order of the items, the first exception raised by
+    function is re-raised once all workers are done."""
+    items = list(items)
+    if len(items) <= 1 or workers <= 1:
+        return [function(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    queue = Queue()
+    for entry in enumerate(items):
+        queue.put(entry)
+
+    def work():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception:
+                errors.append(sys.exc_info()[1])
+
+    threads = [threading.Thread(target=work) for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,119 @@
+"""Stand-ins for the kodi python modules to run the addon outside of kodi"""
+
+import sys
+import types
+
+class KodiStub(object):
+    """Records the calls made to the stubbed kodi modules"""
+
+    def __init__(self, settings=None, profile=''):
+        self.settings = dict(settings or {})
+        self.profile = profile
+        self.calls = []
+        self.keyboard_input = ''
+        # services return right away unless a test keeps kodi running
+        self.abort = True
+
+    def called(self, name):
+        """arguments of all recorded calls of the named function"""
+        return [args for call, args, _ in self.calls if call == name]
+
+    def called_with(self, name):
+        """(args, kwargs) of all recorded calls of the named function"""
+        return [(args, kwargs) for call, args, kwargs in self.calls if call == name]
+
+# the stub the installed modules currently report to
+_current = KodiStub()
+
+def _record(name):
+    def call(*args, **kwargs):
+        _current.calls.append((name, args, kwargs))
+    return call
+
+class ListItem(object):
+    """xbmcgui.ListItem keeping everything set on it"""
+
+    def __init__(self, label='', label2='', path=''):
+        self.label = label
+        self.label2 = label2
+        self.path = path
+        self.art = {}
+        self.info = {}
+        self.properties = {}
+
+    def setLabel(self, label):
+        self.label = label
+
+    def setLabel2(self, label):
+        self.label2 = label
+
+    def setArt(self, art):
+        self.art.update(art)
+
+    def setInfo(self, kind, info):
+        self.info[kind] = info
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+class Dialog(object):
+
+    def input(self, heading, default='', type=0):
+        return _current.keyboard_input
+
+    def notification(self, heading, message, *args, **kwargs):
+        _current.calls.append(('notification', (heading, message), kwargs))
+
+class Monitor(object):
+
+    def abortRequested(self):
+        return _current.abort
+
+    def waitForAbort(self, timeout=None):
+        return _current.abort
+
+class Addon(object):
+
+    def __init__(self, addon_id=None):
+        _current.calls.append(('Addon', (addon_id,), {}))
+
+    def getSetting(self, name):
+        return _current.settings.get(name, '')
+
+    def setSetting(self, name, value):
+        _current.settings[name] = value
+
+    def getAddonInfo(self, name):
+        return _current.profile if name == 'profile' else ''
+
+def _modules():
+    xbmc = types.ModuleType('xbmc')
+    xbmc.LOGNOTICE = 2
+    xbmc.log = _record('log')
+    xbmc.executebuiltin = _record('executebuiltin')
+    xbmc.translatePath = lambda path: path
+    xbmc.Monitor = Monitor
+
+    xbmcgui = types.ModuleType('xbmcgui')
+    xbmcgui.INPUT_ALPHANUM = 0
+    xbmcgui.ListItem = ListItem
+    xbmcgui.Dialog = Dialog
+
+    xbmcplugin = types.ModuleType('xbmcplugin')
+    xbmcplugin.SORT_METHOD_NONE = 0
+    for name in ('setPluginCategory', 'addSortMethod', 'addDirectoryItems', 'endOfDirectory',
+                 'setResolvedUrl', 'setContent'):
+        setattr(xbmcplugin, name, _record(name))
+
+    xbmcaddon = types.ModuleType('xbmcaddon')
+    xbmcaddon.Addon = Addon
+    return xbmc, xbmcgui, xbmcplugin, xbmcaddon
+
+def install(settings=None, profile=''):
+    """Register the stub kodi modules (once) and return a fresh recorder they report to"""
+    global _current
+    _current = KodiStub(settings, profile)
+    if getattr(sys.modules.get('xbmc'), 'Monitor', None) is not Monitor:
+        for module in _modules():
+            sys.modules[module.__name__] = module
+    return _current
@@ -0,0 +1,39 @@
+import xbmc
+import xbmcaddon
+from lib.proxy import StreamProxy
+from lib.transport import Transport
+
+addon = xbmcaddon.Addon()
+proxy = None
+resident = None
+if addon.getSetting('stream_proxy') == 'true':
+    proxy = StreamProxy(
+        Transport(),
+        port=int(addon.getSetting('stream_proxy_port') or 52341),
+        capacity=int(addon.getSetting('stream_proxy_buffer') or 8) * 1024 * 1024)
+    proxy.start()
+if addon.getSetting('resident_service') == 'true':
+    from lib.deezerbackend import DeezerBackend
+    from lib.resident import DEFAULT_PORT, ResidentFrontend, ResidentService
+    frontend = ResidentFrontend(
+        addon,
+        lambda message: xbmc.log(message, xbmc.LOGNOTICE),
+        xbmc.translatePath(addon.getAddonInfo('profile')).decode('utf-8'))
+    try:
+        resident = ResidentService(
+            DeezerBackend, frontend, int(addon.getSetting('resident_service_port') or DEFAULT_PORT)).start()
+    except IOError as error:
+        # the plugin runs the backend itself
+        xbmc.log('resident service not started: %s' % error, xbmc.LOGNOTICE)
+
+class Monitor(xbmc.Monitor):
+
+    def onSettingsChanged(self):
+        if resident:
+            resident.settings_changed()
+
+if proxy or resident:
+    Monitor().waitForAbort()
+    for server in (proxy, resident):
+        if server:
+            server.stop()
\ No newline at end of file